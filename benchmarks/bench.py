@@ -0,0 +1,300 @@
+import os
+import sys
+import json
+import argparse
+import platform
+import tempfile
+from random import Random
+from statistics import median
+from time import perf_counter
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # Runs without a window or GPU
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")  # Keeps the JSON on standard output clean
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # The loaders read the data directory relative to the working directory
+
+import pygame
+from pygame.locals import *
+
+from lib.Loader import Loader
+from lib.Puzzle import PuzzleFactory
+from lib.Board import Board
+from lib.FloatingLayer import FloatingLayer
+from lib.PieceStream import PieceStream
+from lib.GamePart import GamePart
+from lib.Leaderboard import Leaderboard
+from lib.Simulator import Simulator
+from lib.Geometry import fit_geometry
+from lib.UserDatabase import UserDatabase, get_manager, close_database
+from lib.PuzzleCache import get_cache
+from lib.Config import WINDOW_SIZE
+
+def measure(setup, run, repeat):
+    # Time run(state) on a fresh setup() state each round and return the seconds per operation of every round
+    times = []
+    for _ in range(repeat):
+        state = setup()
+        start = perf_counter()
+        ops = run(state)
+        times.append((perf_counter() - start) / max(ops, 1))
+    return times
+
+class Bench(object):
+    def __init__(self, args):
+        # Prepare the screen, the motive and the piece templates shared by the cases
+        self.args = args  # Parsed command line options
+        self.geometry = fit_geometry(args.cols, args.rows)  # Grid of the benchmarked puzzle
+        self.screen = pygame.display.set_mode(WINDOW_SIZE)
+        self.loader = Loader()  # Resource loader
+        self.motive_name = args.motive or sorted(self.loader.list_motives())[0]  # File name of the motive
+        g = self.geometry
+        self.motive = self.loader.load_motive(self.motive_name, (g.width, g.height)).convert_alpha()
+        self.templates = [self.loader.load_image(name) for name in ("piece_mask.png", "piece_bevel.png", "piece_shadow.png")]
+        self.pieces = self.factory().get_pieces()  # Cut once for the cases that only move pieces
+
+    def factory(self):
+        # Return a puzzle factory for the benchmarked motive and grid
+        return PuzzleFactory(self.motive, *self.templates, seed=self.args.seed, geometry=self.geometry)
+
+    def target(self, piece, board):
+        # Return the position a piece snaps into on the board
+        g = self.geometry
+        return (board.r.x + g.tile * piece.px - g.margin, board.r.y + g.tile * piece.py - g.margin)
+
+    def case_cut_make_piece(self):
+        # Cut every piece of the grid one by one
+        g = self.geometry
+
+        def run(pf):
+            for py in range(g.rows):
+                for px in range(g.cols):
+                    pf._make_piece(px, py)
+            return g.count
+        return measure(self.factory, run, self.args.repeat)
+
+    def case_cut_get_pieces(self):
+        # Cut, sort and shuffle the whole puzzle in this process
+        return measure(self.factory, lambda pf: len(pf.get_pieces()), self.args.repeat)
+
+    def _game(self, floating):
+        # Return a game whose first pieces float scattered over the screen, drawn once
+        pieces = self.factory().get_pieces()
+        game = GamePart(pieces, self.motive, "Bench", self.args.seed, self.geometry)
+        rnd = Random(self.args.seed)
+        for p in list(game.stream.pieces)[:floating]:
+            game.stream.remove(p)
+            p.set_pos(rnd.randrange(0, 600), rnd.randrange(100, 650))
+            game.floating.append(p)
+        game.update(self.screen)
+        return game
+
+    def case_game_update_idle(self):
+        # Draw frames in which nothing moved
+        frames = self.args.frames
+
+        def run(game):
+            for _ in range(frames):
+                game.update(self.screen)
+            game.score_table.close()
+            return frames
+        return measure(lambda: self._game(self.args.floating), run, self.args.repeat)
+
+    def case_game_update_drag(self):
+        # Drag the topmost floating piece back and forth, handling one motion event and drawing one frame each time
+        frames = self.args.frames
+
+        def run(game):
+            top = list(game.floating)[-1]
+            pos = top.rect.center
+            game.event(pygame.event.Event(MOUSEBUTTONDOWN, button=1, pos=pos))
+            for i in range(frames):
+                rel = (5, 3) if i % 2 == 0 else (-5, -3)
+                game.event(pygame.event.Event(MOUSEMOTION, pos=pos, rel=rel, buttons=(1, 0, 0)))
+                game.update(self.screen)
+            game.score_table.close()
+            return frames
+        return measure(lambda: self._game(self.args.floating), run, self.args.repeat)
+
+    def case_board_drop(self):
+        # Drop every piece into its place on the board
+        def setup():
+            background = pygame.Surface(WINDOW_SIZE).convert()
+            board = Board(self.motive, self.geometry, background)
+            for p in self.pieces:
+                p.set_pos(*self.target(p, board))
+            return board
+
+        def run(board):
+            for p in self.pieces:
+                board.drop(p)
+            return len(self.pieces)
+        return measure(setup, run, self.args.repeat)
+
+    def case_floating_merge(self):
+        # Lay the pieces out aligned and join each one to its floating neighbours as a drop would
+        def setup():
+            layer = FloatingLayer(self.geometry.size)
+            for p in self.pieces:
+                p.set_pos(self.geometry.tile * p.px, self.geometry.tile * p.py)
+            return layer
+
+        def run(layer):
+            for p in sorted(self.pieces, key=lambda p: (p.py, p.px)):
+                layer.append(p)
+                friends = layer.find_friends(p)
+                if friends:
+                    layer.merge(friends[0], [p] + friends[1:])
+            return len(self.pieces)
+        return measure(setup, run, self.args.repeat)
+
+    def _stream(self):
+        # Return a stream holding every piece
+        return PieceStream(list(self.pieces), 167, 512, self.geometry)
+
+    def case_stream_scroll(self):
+        # Scroll through the whole stream row by row and back, laying out each step
+        def run(stream):
+            rows = -(-len(stream.pieces) // stream.columns)
+            for _ in range(rows):
+                stream.down()
+                stream.layout()
+            for _ in range(rows):
+                stream.up()
+                stream.layout()
+            return 2 * rows
+        return measure(self._stream, run, self.args.repeat)
+
+    def case_stream_remove(self):
+        # Take pieces from random places of the stream, laying out after each like a frame would
+        order = list(self.pieces)
+        Random(self.args.seed).shuffle(order)
+
+        def run(stream):
+            for p in order:
+                stream.remove(p)
+                stream.layout()
+            return len(order)
+        return measure(self._stream, run, self.args.repeat)
+
+    def case_leaderboard_refresh(self):
+        # Read the top scores after a new score was written, against a populated scores table
+        db = UserDatabase()
+        conn = db.connection
+        if conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0] < self.args.scores:
+            rnd = Random(self.args.seed)
+            users = max(1, self.args.scores // 20)
+            conn.executemany("INSERT OR IGNORE INTO users (user_name) VALUES (?)",
+                             [("user%d" % i,) for i in range(users)])
+            conn.executemany("INSERT INTO scores (user_id, score, time, motive, pieces) VALUES (?, ?, ?, ?, ?)",
+                             [(rnd.randrange(1, users + 1), rnd.randrange(10000), rnd.uniform(60, 3600),
+                               self.motive_name, self.geometry.count) for _ in range(self.args.scores)])
+            conn.commit()
+        leaderboard = Leaderboard(db)
+        refreshes = 100
+
+        def run(leaderboard):
+            for _ in range(refreshes):
+                db.scores_changed()
+                leaderboard.refresh()
+            return refreshes
+        times = measure(lambda: leaderboard, run, self.args.repeat)
+        db.close()
+        return times
+
+    def case_solve_frame(self):
+        # Solve a whole puzzle with the scripted player, timing its frames including event handling
+        def run(sim):
+            result = sim.run()
+            return result["frames"]
+        return measure(lambda: Simulator(self.motive_name, self.args.seed, None, self.geometry), run, 1)
+
+    def cases(self):
+        # Return the benchmark cases by name in the order they run
+        return [(name[5:], getattr(self, name)) for name in sorted(dir(self)) if name.startswith("case_")]
+
+def compare(results, baseline, threshold):
+    # Compare the median times with a baseline and return the comparison and the names of the slower cases
+    comparison = {}
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get("cases", {}).get(name)
+        if old is None:
+            continue
+        ratio = result["median"] / old["median"] if old["median"] else 0.0
+        comparison[name] = {"baseline": old["median"], "ratio": ratio, "regressed": ratio > threshold}
+        if ratio > threshold:
+            regressions.append(name)
+    return comparison, regressions
+
+def main():
+    # Run the selected benchmark cases and write their timings as JSON, optionally compared with a baseline
+    parser = argparse.ArgumentParser(description="Pygame Puzzle benchmarks")
+    parser.add_argument("--cols", type=int, default=50, help="number of pieces in a row")
+    parser.add_argument("--rows", type=int, default=40, help="number of pieces in a column")
+    parser.add_argument("--motive", help="motive to cut, the first one by default")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the puzzle and the random layouts")
+    parser.add_argument("--repeat", type=int, default=5, help="rounds of each case, the median is compared")
+    parser.add_argument("--frames", type=int, default=200, help="frames drawn by each round of the update cases")
+    parser.add_argument("--floating", type=int, default=200, help="floating pieces in the update cases")
+    parser.add_argument("--scores", type=int, default=20000, help="rows in the scores table of the leaderboard case")
+    parser.add_argument("--only", nargs="*", help="names of the cases to run, all by default")
+    parser.add_argument("--output", help="file the JSON results are written to, standard output by default")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio counted as a regression")
+    args = parser.parse_args()
+
+    pygame.init()
+
+    # Scores and cut puzzles go to a scratch directory, the shared database and cache are opened there before any game needs them
+    scratch = tempfile.TemporaryDirectory()
+    get_manager(os.path.join(scratch.name, "bench.db"))
+    get_cache(os.path.join(scratch.name, "puzzles"))
+
+    bench = Bench(args)
+    results = {}
+    for name, case in bench.cases():
+        if args.only and name not in args.only:
+            continue
+        times = case()
+        results[name] = {"unit": "s/op", "median": median(times), "min": min(times), "rounds": len(times)}
+        print("%-22s %12.3f us/op" % (name, results[name]["median"] * 1e6), file=sys.stderr)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "pygame": pygame.version.ver,
+            "platform": platform.platform(),
+            "motive": bench.motive_name,
+            "grid": [args.cols, args.rows],
+            "floating": args.floating,
+            "scores": args.scores,
+        },
+        "cases": results,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key in ("motive", "grid", "floating", "scores"):
+            if baseline.get("meta", {}).get(key) != report["meta"][key]:
+                print("Warning: the baseline was run with a different %s" % key, file=sys.stderr)
+        report["comparison"], regressions = compare(results, baseline, args.threshold)
+        for name in regressions:
+            print("Regression: %s is %.2fx slower than the baseline" % (name, report["comparison"][name]["ratio"]),
+                  file=sys.stderr)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    close_database()
+    scratch.cleanup()
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+from bisect import bisect_right
+
+class BlockList(object):
+    def __init__(self, items=(), block_size=64):
+        # Initialize the list as a sequence of small blocks so edits only shift the items of one block
+        self.block_size = block_size  # Number of items a block is filled with, blocks split at twice that
+        self.blocks = []  # Blocks of items in list order
+        self.owner = {}  # Item mapped to the block holding it
+        self.offsets = None  # Index of the first item of each block, rebuilt after a change
+        self.positions = None  # Block id mapped to its position in the block list, rebuilt with the offsets
+        self.size = 0  # Number of items
+        for item in items:
+            self.append(item)
+
+    def __len__(self):
+        # Return the number of items
+        return self.size
+
+    def __iter__(self):
+        # Iterate over the items in order
+        for block in self.blocks:
+            yield from block
+
+    def __contains__(self, item):
+        # Check if an item is in the list
+        return item in self.owner
+
+    def _reindex(self):
+        # Rebuild the block offsets and positions if the blocks changed
+        if self.offsets is None:
+            self.offsets = []
+            self.positions = {}
+            n = 0
+            for i, block in enumerate(self.blocks):
+                self.offsets.append(n)
+                self.positions[id(block)] = i
+                n += len(block)
+
+    def _locate(self, index):
+        # Return the position of the block holding an index and the offset of the index in it
+        if index < 0 or index >= self.size:
+            raise IndexError("BlockList index out of range")
+        self._reindex()
+        k = bisect_right(self.offsets, index) - 1
+        return k, index - self.offsets[k]
+
+    def __getitem__(self, index):
+        # Return the item at an index
+        k, offset = self._locate(index)
+        return self.blocks[k][offset]
+
+    def index(self, item):
+        # Return the index of an item
+        block = self.owner[item]
+        self._reindex()
+        return self.offsets[self.positions[id(block)]] + block.index(item)
+
+    def append(self, item):
+        # Add an item at the end
+        if not self.blocks or len(self.blocks[-1]) >= self.block_size:
+            self.blocks.append([])
+        self.blocks[-1].append(item)
+        self.owner[item] = self.blocks[-1]
+        self.size += 1
+        self.offsets = None
+
+    def insert(self, index, item):
+        # Insert an item before an index, splitting its block if it grew too large
+        if index >= self.size:
+            self.append(item)
+            return
+        k, offset = self._locate(max(index, 0))
+        block = self.blocks[k]
+        block.insert(offset, item)
+        self.owner[item] = block
+        self.size += 1
+        if len(block) > 2 * self.block_size:
+            tail = block[self.block_size:]
+            del block[self.block_size:]
+            self.blocks.insert(k + 1, tail)
+            for moved in tail:
+                self.owner[moved] = tail
+        self.offsets = None
+
+    def remove(self, item):
+        # Remove an item, dropping its block once it is empty
+        block = self.owner.pop(item)
+        block.remove(item)
+        self.size -= 1
+        if not block:
+            self._reindex()
+            del self.blocks[self.positions[id(block)]]
+        self.offsets = None
+
+    def slice(self, start, stop):
+        # Return the items from start up to stop as a list
+        start = max(start, 0)
+        stop = min(stop, self.size)
+        if start >= stop:
+            return []
+        k, offset = self._locate(start)
+        items = []
+        while len(items) < stop - start:
+            block = self.blocks[k]
+            items.extend(block[offset:offset + stop - start - len(items)])
+            k += 1
+            offset = 0
+        return items
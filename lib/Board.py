@@ -1,38 +1,82 @@
 import pygame
 from pygame.locals import *
 
+from lib.Geometry import BOARD_AREA, PuzzleGeometry
+
 class Board(object):
-    def __init__(self, orgimg):
-        # Initialize the board with a rectangular area, an empty list of pieces, and the original image
-        self.r = pygame.Rect(20, 167, 640, 512)  # Defines the board's rectangular area
+    def __init__(self, orgimg, geometry=None, background=None):
+        # Initialize the board with a rectangular area, an empty list of pieces, the original image, and the layer of placed pieces
+        self.geometry = geometry or PuzzleGeometry()  # Grid and piece measurements
+        g = self.geometry
+        self.r = pygame.Rect(20, 167, g.width, g.height)  # Defines the board's rectangular area
+        self.r.center = (20 + BOARD_AREA[0] // 2, 167 + BOARD_AREA[1] // 2)  # Center smaller boards in the board area
         self.pieces = []  # List to store pieces placed on the board
         self.orgimg = orgimg  # Original image to display when the board is complete
+
+        # Placed pieces are composited into a layer over the screen background, which is transparent if not given
+        m = g.margin
+        self.layer_rect = pygame.Rect(self.r.x - m, self.r.y - m, self.r.w + 2 * m + 1, self.r.h + 2 * m + 1)  # Area placed pieces and their shadows can cover
+        if background is not None:
+            self.layer_rect = self.layer_rect.clip(background.get_rect())
+        self.background = background  # Screen background below the layer
+        self.shadows = None  # Background with the shadows of the placed pieces, built with the first piece
+        self.layer = None  # Shadows with the placed pieces on top
    
     def drop(self, piece):
         # Handles dropping a piece or a group of pieces onto the board
         if piece.is_piece():  # Check if the object is a single piece
             if self.r.colliderect(piece.rect):  # Check if the piece is within the board's area
-                destx = self.r.x + (64 * piece.px) - 16  # Calculate the target x-coordinate
-                desty = self.r.y + (64 * piece.py) - 16  # Calculate the target y-coordinate
+                g = self.geometry
+                destx = self.r.x + (g.tile * piece.px) - g.margin  # Calculate the target x-coordinate
+                desty = self.r.y + (g.tile * piece.py) - g.margin  # Calculate the target y-coordinate
                 # Check if the piece is close enough to snap into position
-                if abs(piece.rect.x - destx) <= 10 and abs(piece.rect.y - desty) <= 10:
+                if abs(piece.rect.x - destx) <= g.snap and abs(piece.rect.y - desty) <= g.snap:
                     piece.set_pos(destx, desty)  # Snap the piece into position
                     self.pieces.append(piece)  # Add the piece to the board
+                    self._place(piece)
                     return True
             return False
         else:
             # If the object is a group of pieces, recursively drop each piece
+            piece.sync()  # Give every piece its own position first
             res = False
             for p in piece.pieces:
                 res = self.drop(p)
             return res
        
-    def draw(self, dest):
-        # Draw the board and its pieces onto the destination surface
+    def _place(self, piece):
+        # Composite a newly placed piece into the layer, redrawing only the area it touches
+        if self.layer is None:
+            if self.background is not None:
+                self.shadows = self.background.subsurface(self.layer_rect).copy()
+            else:
+                self.shadows = pygame.Surface(self.layer_rect.size, SRCALPHA)
+            self.layer = self.shadows.copy()
+
+        ox, oy = self.layer_rect.topleft
+        self.shadows.blit(piece.simg, (piece.rect.x + 1 - ox, piece.rect.y + 1 - oy))
+
+        if self.is_complete():
+            # The original image replaces the pieces, only their shadows stay visible around it
+            self.layer.blit(self.shadows, (0, 0))
+            self.layer.blit(self.orgimg, (self.r.x - ox, self.r.y - oy))
+            self.shadows = None
+            return
+
+        # Shadows lie below every piece, so the touched area is rebuilt from the shadows up
+        area = pygame.Rect(piece.rect.x, piece.rect.y, piece.rect.w + 1, piece.rect.h + 1)
+        self.layer.set_clip(area.move(-ox, -oy))
+        self.layer.blit(self.shadows, (0, 0))
         for p in self.pieces:
-            p.draw_shadow(dest, 1)  # Draw shadows for each piece
-        if len(self.pieces) == 80:  # If all pieces are placed, draw the original image
-            dest.blit(self.orgimg, self.r.topleft)
-        else:
-            for p in self.pieces:
-                p.draw(dest)  # Draw each piece individually
\ No newline at end of file
+            if p.rect.colliderect(area):
+                self.layer.blit(p.img, (p.rect.x - ox, p.rect.y - oy))
+        self.layer.set_clip(None)
+
+    def is_complete(self):
+        # Check if every piece of the puzzle has been placed
+        return len(self.pieces) == self.geometry.count
+
+    def draw(self, dest):
+        # Draw the layer of placed pieces onto the destination surface
+        if self.layer is not None:
+            dest.blit(self.layer, self.layer_rect.topleft)
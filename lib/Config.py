@@ -5,4 +5,16 @@ WINDOW_WIDTH = 800
 WINDOW_HEIGHT = 750
 
 # Combine width and height into a tuple representing the window size
-WINDOW_SIZE = (WINDOW_WIDTH, WINDOW_HEIGHT)
\ No newline at end of file
+WINDOW_SIZE = (WINDOW_WIDTH, WINDOW_HEIGHT)
+
+# Draw single pieces with their shadow baked into one sprite, halving the blits of floating and stream pieces
+BAKED_SPRITES = True
+
+# Memory budget of the fonts, images and motives cached by the loaders
+ASSET_CACHE_BYTES = 64 * 1024 * 1024
+
+# Number of piece columns in the stream, 0 or more than fit beside the scroll bar fits as many as the width allows
+STREAM_COLUMNS = 0
+
+# Cut the rows of a puzzle in worker processes, only pays off when cutting a piece costs far more than sending it back
+PARALLEL_CUT = False
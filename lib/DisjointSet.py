@@ -0,0 +1,40 @@
+class DisjointSet(object):
+    def __init__(self):
+        # Initialize an empty forest of sets
+        self.parent = {}  # Element mapped to its parent, roots point to themselves
+        self.size = {}  # Root mapped to the number of elements in its set
+
+    def __contains__(self, x):
+        # Check if an element belongs to any set
+        return x in self.parent
+
+    def add(self, x):
+        # Put an element into a set of its own
+        self.parent[x] = x
+        self.size[x] = 1
+
+    def find(self, x):
+        # Return the root of the set holding an element, halving the path on the way
+        parent = self.parent
+        while parent[x] is not x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a, b):
+        # Join the sets holding two elements, hanging the smaller set under the larger, and return the new root
+        a = self.find(a)
+        b = self.find(b)
+        if a is b:
+            return a
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size.pop(b)
+        return a
+
+    def discard_set(self, elements):
+        # Forget every element of a whole set
+        for x in elements:
+            self.parent.pop(x, None)
+            self.size.pop(x, None)
@@ -0,0 +1,147 @@
+from lib.DisjointSet import DisjointSet
+from lib.Puzzle import PuzzlePieceGroup
+
+class FloatingLayer(object):
+    def __init__(self, cell=96):
+        # Initialize an empty layer of floating pieces and groups with a uniform grid index
+        self.cell = cell  # Size of a grid cell in pixels
+        self.items = {}  # Floating pieces and groups in drawing order, mapped to their z value
+        self.cells = {}  # Grid cell mapped to the items overlapping it
+        self.item_cells = {}  # Item mapped to the grid cells it overlaps
+        self.grid = {}  # Grid position (px, py) mapped to the floating piece from that position
+        self.sets = DisjointSet()  # Floating pieces joined by group membership
+        self.owners = {}  # Root piece of each set mapped to the piece or group it forms
+        self.z = 0  # Z value given to the next item put on top
+
+    def __iter__(self):
+        # Iterate over the items from the bottom to the top
+        return iter(self.items)
+
+    def __len__(self):
+        # Return the number of floating items
+        return len(self.items)
+
+    def __contains__(self, item):
+        # Check if an item is floating
+        return item in self.items
+
+    def _members(self, item):
+        # Return the pieces of a piece or group
+        if item.is_piece():
+            return [item]
+        return item.pieces
+
+    def _index(self, item):
+        # Register an item in every grid cell its bounding rectangle overlaps
+        c = self.cell
+        r = item.get_rect()
+        keys = [(cx, cy) for cx in range(r.left // c, (r.right - 1) // c + 1)
+                for cy in range(r.top // c, (r.bottom - 1) // c + 1)]
+        for key in keys:
+            self.cells.setdefault(key, set()).add(item)
+        self.item_cells[item] = keys
+
+    def _unindex(self, item):
+        # Remove an item from every grid cell it was registered in
+        for key in self.item_cells.pop(item, ()):
+            cell = self.cells[key]
+            cell.discard(item)
+            if not cell:
+                del self.cells[key]
+
+    def append(self, item):
+        # Put an item on top of the layer
+        self.z += 1
+        self.items[item] = self.z
+        self._index(item)
+
+        members = self._members(item)
+        for p in members:
+            self.grid[(p.px, p.py)] = p
+            self.sets.add(p)
+            self.sets.union(members[0], p)
+        self.owners[self.sets.find(members[0])] = item
+
+    def remove(self, item):
+        # Take an item off the layer
+        del self.items[item]
+        self._unindex(item)
+
+        members = self._members(item)
+        del self.owners[self.sets.find(members[0])]
+        for p in members:
+            del self.grid[(p.px, p.py)]
+        self.sets.discard_set(members)
+
+    def raise_to_top(self, item):
+        # Move an item above every other item
+        del self.items[item]
+        self.z += 1
+        self.items[item] = self.z
+
+    def update(self, item):
+        # Refresh the index after an item moved
+        self._unindex(item)
+        self._index(item)
+
+    def translate(self, item, rel):
+        # Move an item by a relative offset and keep the index up to date
+        item.translate(rel)
+        self.update(item)
+
+    def owner(self, piece):
+        # Return the floating piece or group a floating piece belongs to
+        return self.owners[self.sets.find(piece)]
+
+    def merge(self, anchor, others):
+        # Snap other items onto the grid of the anchor and join them into one group, which is returned
+        if anchor.is_piece():
+            # A single piece turns into a new group on top of the layer
+            group = PuzzlePieceGroup(anchor)
+            self.remove(anchor)
+            self.append(group)
+        else:
+            group = anchor
+
+        root = self.sets.find(group.pieces[0])
+        del self.owners[root]
+        for item in others:
+            del self.items[item]
+            self._unindex(item)
+            other = self.sets.find(self._members(item)[0])
+            del self.owners[other]
+            root = self.sets.union(root, other)
+            group.append(item)
+        self.owners[root] = group
+        self.update(group)
+        return group
+
+    def hit(self, pos, accept=None):
+        # Return the topmost item under the position, optionally only items accepted by the filter
+        candidates = self.cells.get((pos[0] // self.cell, pos[1] // self.cell))
+        if not candidates:
+            return None
+        for item in sorted(candidates, key=self.items.get, reverse=True):
+            if accept is not None and not accept(item):
+                continue
+            if item.is_hit(pos):
+                return item
+        return None
+
+    def find_friends(self, item):
+        # Return the other items with a piece aligned next to a piece of the given item, in the order found
+        friends = []
+        for p in self._members(item):
+            x, y = item.get_piece_pos(p)
+            g = p.geometry
+            for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+                n = self.grid.get((p.px + dx, p.py + dy))
+                if n is None:
+                    continue
+                owner = self.owner(n)
+                if owner is item or owner in friends:
+                    continue  # Inner edge of the item, or already snapping
+                nx, ny = owner.get_piece_pos(n)
+                if abs(nx - (x + dx * g.tile)) <= g.snap and abs(ny - (y + dy * g.tile)) <= g.snap:
+                    friends.append(owner)
+        return friends
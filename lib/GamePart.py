@@ -3,15 +3,16 @@ from pygame.locals import *
 import pygame_gui
 
 from lib.Loader import Loader
+from lib.TextRenderer import TextRenderer
 from lib.PieceStream import PieceStream
 from lib.Board import Board
-from lib.Puzzle import PuzzlePieceGroup
 from lib.ScoreTable import ScoreTable
-from random import shuffle, choice, randint
+from lib.FloatingLayer import FloatingLayer
+from random import Random
 from lib.Config import WINDOW_SIZE
 
 class GamePart(object):
-    def __init__(self, pieces, orgimg, user_name="Guest"):
+    def __init__(self, pieces, orgimg, user_name="Guest", seed=None, geometry=None, motive=None):
         # Initialize game components and UI elements
         self.loader = Loader()  # Resource loader
         self.back_color = (50, 50, 50)  # Background color
@@ -26,20 +27,38 @@ class GamePart(object):
             manager=self.ui_manager
         )
 
-        # Initialize the board and shuffle puzzle pieces
-        self.board = Board(orgimg)
-        shuffle(pieces)
-        self.stream = PieceStream(pieces, self.board.r.y, self.board.r.height)
+        # Background of the screen, the board and stream areas are drawn onto it once they are placed
+        self.background = pygame.Surface(WINDOW_SIZE).convert()  # Screen without pieces and texts
+        self.background.fill(self.back_color)
+
+        # Initialize the board and shuffle puzzle pieces, reproducibly when a seed is given
+        self.random = Random(seed)  # Random source for the piece order and split offsets
+        self.board = Board(orgimg, geometry, self.background)
+        pieces.sort(key=lambda p: (p.py, p.px))  # Same order no matter how the pieces were cut
+        self.random.shuffle(pieces)
+        self.stream = PieceStream(pieces, self.board.r.y, self.board.r.height, geometry)
+        pygame.draw.rect(self.background, self.board_color, self.board.r)
+        pygame.draw.rect(self.background, self.stream_color, self.stream.rect)
 
         # Floating pieces and game state variables
-        self.floating = []  # Pieces currently being moved
+        self.floating = FloatingLayer(self.board.geometry.size)  # Pieces lying outside the board and stream
         self.selected = None  # Currently selected piece
         self.scrolling = False  # Whether the stream is being scrolled
         self.next_part = 0  # Indicator for the next game state
         self.game_completed = False  # Whether the puzzle is completed
 
         # Score tracking
-        self.score_table = ScoreTable(user_name=user_name)
+        self.score_table = ScoreTable(user_name=user_name, motive=motive, pieces=self.board.geometry.count)
+        self.text = TextRenderer(self.loader)  # Cached fonts and rendered texts
+
+        # Dirty-rectangle rendering state
+        self.dirty = [pygame.Rect((0, 0), WINDOW_SIZE)]  # Screen areas changed since the last frame
+        self.dirty_rects = []  # Screen areas redrawn by the last update, for the display update
+        self.hud_lines = None  # Score, time and bonus texts of the last frame
+        self.hud_rects = []  # Screen areas covered by the score, time and bonus texts
+        self.completion_rect = None  # Screen area of the completion message
+        self.stream_version = None  # Layout version of the stream in the last frame
+        self.ui_image = None  # Exit button image of the last frame
 
     def event(self, event):
         # Handle user input and UI events
@@ -59,9 +78,9 @@ class GamePart(object):
             elif event.key == K_UP:
                 self.stream.up()
             elif event.key == K_PAGEDOWN:
-                self.stream.down(6)
+                self.stream.down(self.stream.page_size)
             elif event.key == K_PAGEUP:
-                self.stream.up(6)
+                self.stream.up(self.stream.page_size)
         elif event.type == MOUSEBUTTONDOWN:
             # Handle mouse button press
             self._handle_mouse_down(event)
@@ -81,14 +100,11 @@ class GamePart(object):
                 self.scrolling = True
             else:
                 # Check if a floating piece is clicked
-                for p in self.floating[::-1]:
-                    if p.is_hit(event.pos):
-                        self.selected = p
-                        break
+                self.selected = self.floating.hit(event.pos)
                 if self.selected:
-                    # Move the selected piece to the top of the floating list
-                    self.floating.remove(self.selected)
-                    self.floating.append(self.selected)
+                    # Move the selected piece to the top of the floating pieces
+                    self.floating.raise_to_top(self.selected)
+                    self.invalidate(self._area(self.selected))
                 else:
                     # Select a piece from the stream
                     self.selected = self.stream.get_piece_at(event.pos)
@@ -97,22 +113,19 @@ class GamePart(object):
                         self.floating.append(self.selected)
         elif event.button == 3:  # Right click
             # Split a group of pieces into individual pieces
-            sel = None
-            for p in self.floating[::-1]:
-                if p.is_hit(event.pos):
-                    if not p.is_piece():
-                        sel = p
-                        break
+            sel = self.floating.hit(event.pos, lambda p: not p.is_piece())
             if sel:
+                self.invalidate(self._area(sel).inflate(20, 20))  # Pieces spread out by up to 10 pixels
                 self.floating.remove(sel)
+                sel.sync()  # Give every piece its own position again
                 for p in sel.pieces:
-                    p.rect.x += randint(3, 10) * choice((1, -1))
-                    p.rect.y += randint(3, 10) * choice((1, -1))
+                    p.rect.x += self.random.randint(3, 10) * self.random.choice((1, -1))
+                    p.rect.y += self.random.randint(3, 10) * self.random.choice((1, -1))
                     self.floating.append(p)
         elif event.button == 4:  # Scroll up
-            self.stream.up()
+            self.stream.fling(-1)
         elif event.button == 5:  # Scroll down
-            self.stream.down()
+            self.stream.fling(1)
 
     def _handle_mouse_up(self, event):
         # Handle mouse button release for dropping pieces
@@ -120,6 +133,9 @@ class GamePart(object):
             self.scrolling = False
             self.stream.stop_scroll()
         elif self.selected:
+            snap = self.board.geometry.snap
+            self.invalidate(self._area(self.selected).inflate(2 * snap, 2 * snap))  # Pieces may snap into place
+
             # Try to drop the selected piece onto the board
             if self.board.drop(self.selected):
                 self.floating.remove(self.selected)
@@ -131,25 +147,14 @@ class GamePart(object):
                 # Drop the piece back into the stream
                 self.floating.remove(self.selected)
             else:
-                # Check if the selected piece can be grouped with another piece
-                friend = None
-                for f in self.floating:
-                    if f == self.selected:
-                        continue
-                    if f.is_friend(self.selected):
-                        friend = f
-                        break
-                if friend:
-                    if not friend.is_piece():
-                        friend.append(self.selected)
-                        self.floating.remove(self.selected)
-                    else:
-                        # Create a new group of pieces
-                        ppg = PuzzlePieceGroup(friend)
-                        ppg.append(self.selected)
-                        self.floating.remove(self.selected)
-                        self.floating.remove(friend)
-                        self.floating.append(ppg)
+                # Check if the selected piece can be grouped with its neighbors
+                friends = self.floating.find_friends(self.selected)
+                if friends:
+                    # The first neighbor keeps its position, the others snap to it
+                    for f in friends:
+                        self.invalidate(self._area(f))
+                    group = self.floating.merge(friends[0], [self.selected] + friends[1:])
+                    self.invalidate(self._area(group))
 
         self.selected = None
 
@@ -158,77 +163,124 @@ class GamePart(object):
         if self.scrolling:
             self.stream.do_scroll(event.pos)
         elif self.selected:
-            self.selected.translate(event.rel)
-
-    def update(self, screen): 
-        # Update the game state and render the screen
-        screen.fill(self.back_color)  # Fill the background
+            self.invalidate(self._area(self.selected))
+            self.floating.translate(self.selected, event.rel)
+            self.invalidate(self._area(self.selected))
 
-        # Draw the board and stream areas
-        pygame.draw.rect(screen, self.board_color, self.board.r)
-        pygame.draw.rect(screen, self.stream_color, self.stream.rect)
+    def _area(self, item):
+        # Return the screen area covered by a piece or group including its shadow
+        r = item.get_rect()
+        return pygame.Rect(r.x, r.y, r.w + 3, r.h + 3)
 
-        # Draw the board, stream, and floating pieces
-        self.board.draw(screen)
-        self.stream.draw(screen)
-        for p in self.floating:
-            p.draw_shadow(screen)
-            p.draw(screen)
+    def invalidate(self, rect):
+        # Mark a screen area for redrawing in the next frame
+        self.dirty.append(pygame.Rect(rect))
 
+    def update(self, screen):
+        # Update the game state and redraw the screen areas that changed since the last frame
         # Check if the puzzle is completed
-        if len(self.board.pieces) == 80 and not self.game_completed:
+        if self.board.is_complete() and not self.game_completed:
             self.game_completed = True
             self.score_table.mark_completed()  # Mark the puzzle as completed
             self.score_table.apply_time_bonus()  # Apply a time bonus to the score
+            w, h = self.text.size("Puzzle Completed!", "black", 30)
+            self.completion_rect = pygame.Rect(0, 0, w, h)
+            self.completion_rect.center = (self.board.r.centerx, self.board.r.bottom + 35)
+            self.invalidate(self.board.r)  # The original image replaces the pieces
+            self.invalidate(self.completion_rect.inflate(10, 10))
 
-        # Draw the score and time
-        self._draw_score(screen)
+        # Lay out the stream once for all events of the frame and redraw it after it scrolled or its pieces changed
+        self.stream.tick()
+        self.stream.layout()
+        if self.stream.version != self.stream_version:
+            self.stream_version = self.stream.version
+            self.invalidate((self.stream.rect.x, 0, self.stream.scroll_box.right - self.stream.rect.x, screen.get_height()))
 
-        # Display a completion message if the puzzle is finished
-        if self.game_completed:
-            completion_text = self.loader.load_font_black(30).render(
-                "Puzzle Completed!", True, (0, 255, 0)
-            )
-            completion_rect = completion_text.get_rect(
-                center=(self.board.r.centerx, self.board.r.bottom + 35)  
-            )
-            pygame.draw.rect(screen, (0, 0, 0), completion_rect.inflate(10, 10))  
-            screen.blit(completion_text, completion_rect.topleft)
-
-        # Update and draw the UI
+        # Redraw the score display when one of its texts changed
+        lines = self._score_lines()
+        if lines != self.hud_lines:
+            for r in self.hud_rects:
+                self.invalidate(r)
+            self.hud_lines = lines
+            self.hud_rects = []
+            y = 10
+            for text in lines:
+                r = pygame.Rect((20, y), self.text.size(text, "medium", 20))
+                self.hud_rects.append(r.inflate(4, 4))
+                y = r.bottom + 10
+            for r in self.hud_rects:
+                self.invalidate(r)
+
+        # Update the UI and redraw the exit button when its look changed
         self.ui_manager.update(1 / 30)
-        self.ui_manager.draw_ui(screen)
+        if self.exit_button.image is not self.ui_image:
+            self.ui_image = self.exit_button.image
+            self.invalidate(self.exit_button.rect)
+
+        # Redraw each changed area over the background
+        self.dirty_rects = self._merge(self.dirty, screen.get_rect())
+        self.dirty = []
+        for r in self.dirty_rects:
+            screen.set_clip(r)
+            screen.blit(self.background, r, r)
+            self._draw(screen, r)
+        screen.set_clip(None)
 
         return self.next_part  # Return the next game state
 
-    def _draw_score(self, screen):
-        # Draw the score, elapsed time, and bonus message
-        font = self.loader.load_font_medium(20)
+    def _merge(self, rects, bounds):
+        # Clip the rectangles to the screen and join overlapping ones so no area is drawn twice
+        merged = []
+        for r in rects:
+            r = r.clip(bounds)
+            if not r.w or not r.h:
+                continue
+            i = r.collidelist(merged)
+            while i != -1:
+                r = r.union(merged.pop(i))
+                i = r.collidelist(merged)
+            merged.append(r)
+        return merged
 
-        # Display the current score
-        score_text = font.render(f"Score: {self.score_table.score}", True, (255, 255, 255))
-        score_rect = score_text.get_rect(topleft=(20, 10))
-        pygame.draw.rect(screen, (0, 0, 0), score_rect.inflate(4, 4))  
-        screen.blit(score_text, score_rect.topleft)
+    def _draw(self, screen, area):
+        # Draw everything overlapping an area, the screen is clipped to it
+        # Draw the board, stream, and floating pieces
+        self.board.draw(screen)
+        self.stream.draw(screen)
+        for p in self.floating:
+            if self._area(p).colliderect(area):
+                p.draw_with_shadow(screen)
+
+        # Draw the score and time
+        self._draw_score(screen)
 
-        # Display the elapsed time
+        # Display a completion message if the puzzle is finished
+        if self.game_completed and self.completion_rect.inflate(10, 10).colliderect(area):
+            completion_text = self.text.render("Puzzle Completed!", "black", 30, (0, 255, 0))
+            pygame.draw.rect(screen, (0, 0, 0), self.completion_rect.inflate(10, 10))
+            screen.blit(completion_text, self.completion_rect.topleft)
+
+        # Draw the UI
+        self.ui_manager.draw_ui(screen)
+
+    def _score_lines(self):
+        # Return the score, elapsed time, and bonus texts
         elapsed_time = self.score_table.get_elapsed_time()
         minutes = int(elapsed_time // 60)
         seconds = int(elapsed_time % 60)
-        time_text = font.render(f"Time: {minutes:02}:{seconds:02}", True, (255, 255, 255))
-        time_rect = time_text.get_rect(topleft=(20, score_rect.bottom + 10))
-        pygame.draw.rect(screen, (0, 0, 0), time_rect.inflate(4, 4))  
-        screen.blit(time_text, time_rect.topleft)
-
-        # Display the bonus message
         _, bonus_message = self.score_table.calculate_time_bonus()
-        bonus_text = font.render(f"{bonus_message}", True, (255, 255, 255))
-        bonus_rect = bonus_text.get_rect(topleft=(20, time_rect.bottom + 10))
-        pygame.draw.rect(screen, (0, 0, 0), bonus_rect.inflate(4, 4))  
-        screen.blit(bonus_text, bonus_rect.topleft)
+        return (f"Score: {self.score_table.score}", f"Time: {minutes:02}:{seconds:02}", f"{bonus_message}")
+
+    def _draw_score(self, screen):
+        # Draw the score, elapsed time, and bonus message in the areas laid out by update
+        for text, r in zip(self.hud_lines, self.hud_rects):
+            if not r.colliderect(screen.get_clip()):
+                continue
+            pygame.draw.rect(screen, (0, 0, 0), r)
+            screen.blit(self.text.render(text, "medium", 20, (255, 255, 255)), (r.x + 2, r.y + 2))
 
-    def __del__(self):
-        # Save the best score and clean up resources when the game ends
+    def close(self):
+        # Save the best score and release resources when the game is left
         if self.game_completed:  
             self.score_table.save_best_score()
         self.score_table.close()
\ No newline at end of file
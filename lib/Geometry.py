@@ -0,0 +1,37 @@
+# Size of the area reserved for the board in the window
+BOARD_AREA = (640, 512)
+
+# Tile size of the original artwork, the piece templates are drawn for it
+TEMPLATE_TILE = 64
+
+class PuzzleGeometry(object):
+    def __init__(self, cols=10, rows=8, tile=64):
+        # Initialize the grid size and derive the piece measurements from the tile size
+        # The piece forms and the cutting workers derive the tile back from the piece size, which needs whole peg margins
+        if tile < 8 or tile % 4:
+            raise ValueError("The tile size must be a multiple of 4 of at least 8 pixels, got %d" % tile)
+        self.cols = cols  # Number of pieces in a row
+        self.rows = rows  # Number of pieces in a column
+        self.tile = tile  # Size of the square part of a piece
+        self.margin = tile // 4  # Space a peg sticks out of the tile
+        self.size = tile + 2 * self.margin  # Size of a piece image including its pegs
+        self.count = cols * rows  # Number of pieces in the puzzle
+        self.width = cols * tile  # Width of the assembled picture
+        self.height = rows * tile  # Height of the assembled picture
+        self.snap = max(4, (10 * tile) // TEMPLATE_TILE)  # Distance within which pieces snap together
+
+    def key(self):
+        # Return the (columns, rows, tile) tuple identifying this geometry
+        return (self.cols, self.rows, self.tile)
+
+    def piece_center(self, px, py):
+        # Return the initial center of the piece at the given grid position
+        return (self.tile * px + 5 * self.margin // 2, self.tile * py + 5 * self.margin // 2)
+
+def fit_geometry(cols, rows):
+    # Return the geometry with the largest tile that fits the board area, up to the template size
+    tile = min(TEMPLATE_TILE, BOARD_AREA[0] // cols, BOARD_AREA[1] // rows)
+    tile -= tile % 4  # Keep the peg margin a whole number of pixels
+    if tile < 8:
+        raise ValueError("A %dx%d puzzle does not fit the board" % (cols, rows))
+    return PuzzleGeometry(cols, rows, tile)
@@ -1,24 +1,47 @@
 import pygame
 from pygame.locals import *
 import pygame_gui
+from os import path
+import hashlib
+from random import randrange
+from concurrent.futures import BrokenExecutor
+from time import perf_counter
 
 from lib.Loader import Loader
-from lib.Puzzle import PuzzleFactory    
-from lib.Config import WINDOW_SIZE
+from lib.Puzzle import PuzzleFactory, encode_edges, get_form_atlas, get_pool, shutdown_pool
+from lib.PuzzleCache import get_cache
+from lib.Geometry import PuzzleGeometry
+from lib.Config import WINDOW_SIZE, PARALLEL_CUT
+
+# Time spent cutting pieces serially in one frame of the loading screen
+CUT_FRAME_SECONDS = 1.0 / 60
 
 class LoadPart(object):
-    def __init__(self, filename, user_name="Guest"):
+    def __init__(self, filename, user_name="Guest", seed=None, edge_code=None, geometry=None, motive=None):
         # Initialize the loading screen for cutting puzzle pieces
         self.ui_manager = pygame_gui.UIManager(WINDOW_SIZE)  # UI manager for handling events
         self.loader = Loader()  # Resource loader
         self.back_color = (50, 50, 50)  # Background color
+        self.geometry = geometry or PuzzleGeometry()  # Grid and piece measurements
+        g = self.geometry
+
+        # Load the piece templates
+        mask_image = self.loader.load_image("piece_mask.png")  # Mask for pieces
+        bevel_image = self.loader.load_image("piece_bevel.png")  # Bevel effect
+        shadow_image = self.loader.load_image("piece_shadow.png")  # Shadow effect
 
-        # Load the puzzle image and related assets
-        self.image = self.loader.load_motive(filename).convert_alpha()  # Puzzle image
-        mask_image = self.loader.load_image("piece_mask.png").convert_alpha()  # Mask for pieces
-        bevel_image = self.loader.load_image("piece_bevel.png").convert_alpha()  # Bevel effect
-        shadow_image = self.loader.load_image("piece_shadow.png").convert_alpha()  # Shadow effect
-        self.pf = PuzzleFactory(self.image, mask_image, bevel_image, shadow_image)  # Puzzle factory
+        # Look up an already cut puzzle for this motive and seed, or for the shared edge table
+        replay = seed is not None or bool(edge_code)  # Only a given layout can have been cut before
+        if seed is None:
+            seed = randrange(2 ** 32)
+        self.seed = seed  # Seed of the puzzle edges and piece order
+        self.cache = get_cache()  # On-disk cache of cut puzzles
+        self.cache_key = None  # Key of the puzzle in the cache, None for a random layout that is never cut again
+        cached = None
+        if replay:
+            layout = "e" + hashlib.sha1(edge_code.encode("ascii")).hexdigest() if edge_code else seed  # Large tables exceed file name limits
+            self.cache_key = self.cache.make_key(path.join(self.loader.motive_path, filename), g.key(), layout)
+            cached = self.cache.load(self.cache_key, get_form_atlas(mask_image, bevel_image, shadow_image, g.size), g)
 
         self.fnt = self.loader.load_font_black(30)  # Font for rendering text
 
@@ -27,6 +50,30 @@ class LoadPart(object):
         self.px = 0  # Current x-coordinate for cutting
         self.py = 0  # Current y-coordinate for cutting
 
+        if cached:
+            # Reuse the cached image and pieces, nothing is left to cut
+            self.image, self.pieces, edges = cached
+            self.edge_code = encode_edges(edges)  # Serialized edge table for sharing the layout
+            self.pf = None
+            self.futures = []
+        else:
+            # Load the puzzle image, waiting for the menu's background load if there is one, and set up the factory
+            if motive is not None:
+                image = motive.result()
+            else:
+                image = self.loader.load_motive(filename, (g.width, g.height))
+            self.image = image.convert_alpha()  # Puzzle image
+            self.pf = PuzzleFactory(self.image, mask_image, bevel_image, shadow_image, seed, edge_code, g)  # Puzzle factory
+            self.edge_code = self.pf.get_edge_code()  # Serialized edge table for sharing the layout
+
+            # Spread the rows of the grid across the worker processes if enabled, cutting serially if no pool is available
+            self.futures = None  # Pending rows of pieces, None when cutting serially
+            if PARALLEL_CUT:
+                try:
+                    self.futures = self.pf.submit_rows(get_pool())
+                except (OSError, NotImplementedError, BrokenExecutor):
+                    shutdown_pool()  # A broken pool is replaced by the next puzzle
+
         # Progress bar and its container
         self.bar = pygame.Rect(0, 0, 400, 20)  # Progress bar
         self.bar.center = (400, 470)
@@ -35,22 +82,55 @@ class LoadPart(object):
 
         self.next_part = 0  # Indicator for transitioning to the next game state
         self.user_name = user_name  # Player's username
+        self.filename = filename  # File name of the motive
 
     def event(self, event):
         # Handle user input events
         if event.type == KEYDOWN:
             if event.key == K_ESCAPE:  # Exit the loading screen
                 self.next_part = -1
+                for f in self.futures or []:
+                    f.cancel()  # Drop rows that have not been started yet
 
     def get_next(self):
-        # Generate the next puzzle piece
-        self.pieces.append(self.pf._make_piece(self.px, self.py))  # Create a piece at (px, py)
-        self.px += 1
-        if self.px == 10:  # Move to the next row after 10 pieces
-            self.px = 0
-            self.py += 1
-            if self.py == 8:  # Transition to the next state after all pieces are created
-                self.next_part = 1
+        # Collect the rows finished by the worker processes, or cut the next piece serially
+        if self.next_part == -1:
+            return  # Loading was aborted, the cancelled rows are not collected
+        if self.futures is not None:
+            for f in [f for f in self.futures if f.done() and not f.cancelled()]:
+                if f.exception() is not None:  # A worker died, start over without the pool
+                    shutdown_pool()  # The next puzzle starts a fresh pool
+                    self.futures = None
+                    self.pieces = []
+                    return
+                self.futures.remove(f)
+                for data in f.result():
+                    self.pieces.append(self.pf.make_piece_from_data(data))
+            if not self.futures:  # Transition to the next state after all rows are cut
+                self._finish()
+            return
+
+        # Cut as many pieces as fit in the time of a frame, so the progress bar keeps moving
+        start = perf_counter()
+        while self.next_part == 0 and perf_counter() - start < CUT_FRAME_SECONDS:
+            self.pieces.append(self.pf._make_piece(self.px, self.py))  # Create a piece at (px, py)
+            self.px += 1
+            if self.px == self.geometry.cols:  # Move to the next row after a full row of pieces
+                self.px = 0
+                self.py += 1
+                if self.py == self.geometry.rows:  # Transition to the next state after all pieces are created
+                    self._finish()
+
+    def _finish(self):
+        # Store a freshly cut puzzle with a given layout in the cache and move on to the game
+        if self.pf is not None:
+            if self.cache_key is not None:
+                try:
+                    self.cache.store(self.cache_key, self.image, self.pieces, self.pf.edges)
+                except OSError:
+                    pass  # The cache is only an optimization
+            self.pf = None
+        self.next_part = 1
 
     def update(self, screen):
         # Update the loading screen and render progress
@@ -58,14 +138,14 @@ class LoadPart(object):
         screen.fill(self.back_color)  # Fill the background
 
         # Render the progress text
-        txt = self.fnt.render("Cutting pieces %d/80" % len(self.pieces), True, (255, 255, 255))  
+        txt = self.fnt.render("Cutting pieces %d/%d" % (len(self.pieces), self.geometry.count), True, (255, 255, 255))
         txtr = txt.get_rect()
         txtr.center = (WINDOW_SIZE[0] // 2, WINDOW_SIZE[1] // 2 - 50)  # Move text slightly higher
         screen.blit(txt, txtr.topleft)
 
         # Update and render the progress bar
         self.box.center = (WINDOW_SIZE[0] // 2, WINDOW_SIZE[1] // 2)  # Adjust vertical position of the container
-        self.bar.w = int(round((len(self.pieces) / 80.0) * (self.box.width - 4)))  # Calculate progress width
+        self.bar.w = int(round((len(self.pieces) / float(self.geometry.count)) * (self.box.width - 4)))  # Calculate progress width
         self.bar.topleft = (self.box.left + 2, self.box.top + 2)  # Align progress bar inside the container
 
         pygame.draw.rect(screen, (255, 255, 255), self.box, 1)  # Draw the progress bar container
@@ -1,38 +1,107 @@
 import pygame
 from pygame.locals import *
 from os import path, listdir
+from collections import OrderedDict
+import threading
+
+from lib.Config import ASSET_CACHE_BYTES
+from lib.Puzzle import is_opaque
+
+class AssetCache(object):
+    def __init__(self, max_bytes=ASSET_CACHE_BYTES):
+        # Initialize an empty cache with a memory budget
+        self.max_bytes = max_bytes  # Total size allowed before the least recently used assets are dropped
+        self.entries = OrderedDict()  # Assets and their sizes keyed by kind and arguments, least recently used first
+        self.bytes = 0  # Total size of the cached assets
+        self.hits = 0  # Number of lookups served from the cache
+        self.misses = 0  # Number of lookups that had to load the asset
+        self.lock = threading.Lock()  # Guards the entries against loads from background threads
+
+    def get(self, key, load, size_of):
+        # Return the cached asset for a key, loading and measuring it on a miss
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        asset = load()  # Load outside the lock so other threads are not blocked by the disk
+        size = size_of(asset)
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = (asset, size)
+                self.bytes += size
+            while self.bytes > self.max_bytes and len(self.entries) > 1:
+                _, (_, old_size) = self.entries.popitem(last=False)  # Drop the least recently used asset
+                self.bytes -= old_size
+        return asset
+
+    def stats(self):
+        # Return the hit and miss counters and the current size of the cache
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries), "bytes": self.bytes}
+
+# Cache shared by every loader in the process
+_cache = AssetCache()
+
+def _surface_size(surface):
+    # Return the number of bytes held by the pixels of a surface
+    return surface.get_pitch() * surface.get_height()
 
 class Loader:
-    def __init__(self):      
+    def __init__(self):
         # Initialize paths for images, motives, and fonts
         self.img_path = path.join("data", "img")  # Path to general images
         self.motive_path = path.join("data", "motive")  # Path to puzzle motives
         self.font_path = path.join("data", "fnt")  # Path to font files
-   
+        self.cache = _cache  # Assets shared by all loaders, the returned surfaces must not be modified
+
     def load_image(self, filename):
-        # Load an image from the img_path directory
-        return pygame.image.load(path.join(self.img_path, filename))
+        # Load an image from the img_path directory, converted for fast blitting once a display exists
+        def load():
+            img = pygame.image.load(path.join(self.img_path, filename))
+            if pygame.display.get_surface() is not None:
+                img = img.convert_alpha()
+            return img
+        return self.cache.get(("image", filename), load, _surface_size)
 
-    def load_motive(self, filename):
+    def load_motive(self, filename, size=(640, 512)):
         # Load and scale a puzzle motive image
         file_path = path.join(self.motive_path, filename)
-        img = pygame.image.load(file_path)
-    
-        if filename.lower().endswith('.png'):
-            img = img.convert_alpha()  # Preserve transparency for PNG files
-        else:
-            img = img.convert()  # Optimize for display without transparency
-    
-        return pygame.transform.smoothscale(img, (640, 512))  # Resize to fit the board
+
+        def load():
+            img = pygame.image.load(file_path)
+
+            if filename.lower().endswith('.png'):
+                img = img.convert_alpha()  # Preserve transparency for PNG files
+                if is_opaque(img):
+                    img = img.convert()  # Scaling without alpha keeps every pixel fully opaque at any size
+            else:
+                img = img.convert()  # Optimize for display without transparency
+
+            return pygame.transform.smoothscale(img, size)  # Resize to fit the board
+        return self.cache.get(("motive", filename, tuple(size)), load, _surface_size)
 
     def list_motives(self):
         # List all available puzzle motive files (JPG and PNG) in the motive_path directory
         return [f for f in listdir(self.motive_path) if f.lower().endswith(('.jpg', '.png'))]
 
+    def _load_font(self, filename, size):
+        # Load a font file with the specified size, charging the file size against the cache budget
+        file_path = path.join(self.font_path, filename)
+        return self.cache.get(("font", filename, size), lambda: pygame.font.Font(file_path, size),
+                              lambda font: path.getsize(file_path))
+
     def load_font_black(self, size):
         # Load the "Black" font with the specified size
-        return pygame.font.Font(path.join(self.font_path, "FixelDisplay-Black.otf"), size)
+        return self._load_font("FixelDisplay-Black.otf", size)
 
     def load_font_medium(self, size):
         # Load the "Medium" font with the specified size
-        return pygame.font.Font(path.join(self.font_path, "FixelDisplay-Medium.otf"), size)
\ No newline at end of file
+        return self._load_font("FixelDisplay-Medium.otf", size)
+
+    def stats(self):
+        # Return the hit and miss counters of the shared asset cache
+        return self.cache.stats()
@@ -5,10 +5,12 @@ import pygame_gui
 from lib.Loader import Loader
 from lib.UserDatabase import UserDatabase  
 from lib.Leaderboard import Leaderboard  
+from lib.MotiveGallery import MotiveGallery
+from lib.Prefetcher import MotivePrefetcher
 from lib.Config import WINDOW_SIZE
 
 class MenuPart(object):
-    def __init__(self):
+    def __init__(self, geometry=None):
         # Initialize the menu screen
         self.loader = Loader()  # Resource loader
         self.back_color = (50, 50, 50)  # Background color
@@ -86,25 +88,10 @@ class MenuPart(object):
         self.next_part = 0  # Indicator for transitioning to the next game state
         self.error_message = ""  # Error message for invalid inputs
 
-        # Load and prepare puzzle motives
-        self._make_motives()
+        # Puzzle motives, their thumbnails are loaded when they are first shown
+        self.motives = MotiveGallery(self.loader, self.fnt_medium, (self.motive_width, self.motive_height))
         self.motive_idx = 0  # Index of the currently selected motive
-
-    def fix_text(self, txt):
-        # Format the motive filename into a readable title
-        return " ".join(txt.split(".")[0].split("_"))
-
-    def _make_motives(self):
-        # Load and scale all available puzzle motives
-        l = self.loader.list_motives()
-        self.motives = []
-        for f in l:
-            try:
-                i = self.loader.load_motive(f)
-                i = pygame.transform.smoothscale(i, (self.motive_width, self.motive_height))
-                self.motives.append((i, f, self.fnt_medium.render(self.fix_text(f), True, (255, 255, 255))))
-            except:
-                pass
+        self.prefetcher = MotivePrefetcher(self.loader, geometry)  # Loads the highlighted motive in the background
 
     def event(self, event):
         # Handle user input and UI events
@@ -166,16 +153,22 @@ class MenuPart(object):
 
     def get_motive(self):
         # Return the filename of the currently selected motive
-        return self.motives[self.motive_idx][1]
+        return self.motives.get(self.motive_idx)[1]
+
+    def take_prefetched(self):
+        # Return the future of the selected motive loaded in the background, or None
+        return self.prefetcher.take(self.get_motive())
 
     def update(self, screen):
         # Update the menu screen and render its components
         self.leaderboard.refresh()  # Refresh the leaderboard
         screen.fill(self.back_color)  # Fill the background
 
-        if not len(self.motives):
+        motive = self.motives.get(self.motive_idx)
+        if motive is None:
             print("Error: No motives found.")
             return -1
+        self.motive_idx %= len(self.motives)  # Motives that failed to load were dropped
 
         # Define the leaderboard area
         leaderboard_rect = pygame.Rect(15, 130, 300, 60 + len(self.leaderboard.entries) * 40)
@@ -192,7 +185,7 @@ class MenuPart(object):
         )
 
         # Render the selected motive
-        screen.blit(self.motives[self.motive_idx][0], self.motive_r.topleft)
+        screen.blit(motive[0], self.motive_r.topleft)
 
         # Render the "Select motive" text
         pygame.draw.rect(screen, (0, 0, 0), self.txtr.inflate(10, 10))
@@ -208,7 +201,7 @@ class MenuPart(object):
         self.leaderboard.draw(screen, self.fnt_medium, leaderboard_rect.x, leaderboard_rect.y)
 
         # Render the title of the selected motive
-        t = self.motives[self.motive_idx][2]
+        t = motive[2]
         tr = t.get_rect()
         tr.center = (self.motive_r.centerx, self.select_button.rect.bottom + 30)
         pygame.draw.rect(screen, (0, 0, 0), tr.inflate(10, 10))
@@ -225,4 +218,8 @@ class MenuPart(object):
         self.ui_manager.update(1 / 30)
         self.ui_manager.draw_ui(screen)
 
+        # Prepare a neighbouring thumbnail for browsing and start loading the highlighted motive
+        self.motives.prefetch(self.motive_idx)
+        self.prefetcher.request(motive[1])
+
         return self.next_part  # Return the next game state
\ No newline at end of file
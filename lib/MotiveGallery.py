@@ -0,0 +1,73 @@
+import pygame
+from pygame.locals import *
+from os import path
+import os
+
+class MotiveGallery(object):
+    def __init__(self, loader, font, size=(300, 250), cache_dir=path.join("data", "cache", "thumbs")):
+        # Initialize the gallery with the motive file names only, thumbnails are made when first shown
+        self.loader = loader  # Resource loader for the motives
+        self.font = font  # Font of the motive titles
+        self.size = size  # Size of a thumbnail
+        self.cache_dir = cache_dir  # Directory holding the thumbnails of earlier sessions
+        self.files = loader.list_motives()  # Motive file names
+        self.thumbs = {}  # File name mapped to (thumbnail, file name, rendered title)
+
+    def __len__(self):
+        # Return the number of motives
+        return len(self.files)
+
+    def fix_text(self, txt):
+        # Format the motive filename into a readable title
+        return " ".join(txt.split(".")[0].split("_"))
+
+    def _thumb_file(self, filename):
+        # Return the cache file of a motive thumbnail, named after the motive's mtime and size
+        st = os.stat(path.join(self.loader.motive_path, filename))
+        return path.join(self.cache_dir, "%s_%d_%d_%dx%d.png" % (filename, st.st_mtime_ns, st.st_size, self.size[0], self.size[1]))
+
+    def _make_thumb(self, filename):
+        # Load a thumbnail from the disk cache, or scale the motive down and store the result
+        thumb_file = self._thumb_file(filename)
+        if path.exists(thumb_file):
+            try:
+                img = pygame.image.load(thumb_file)
+                return img.convert_alpha() if filename.lower().endswith('.png') else img.convert()
+            except pygame.error:
+                pass  # Make the thumbnail again
+
+        img = pygame.transform.smoothscale(self.loader.load_motive(filename), self.size)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for name in os.listdir(self.cache_dir):
+                if name.rsplit("_", 3)[0] == filename:
+                    os.remove(path.join(self.cache_dir, name))  # Drop thumbnails of older versions of the motive
+            pygame.image.save(img, thumb_file)
+        except (OSError, pygame.error):
+            pass  # The cache is only an optimization
+        return img
+
+    def get(self, idx):
+        # Return (thumbnail, file name, rendered title) of a motive, dropping motives that cannot be loaded
+        while self.files:
+            idx %= len(self.files)
+            filename = self.files[idx]
+            entry = self.thumbs.get(filename)
+            if entry is not None:
+                return entry
+            try:
+                thumb = self._make_thumb(filename)
+            except (OSError, pygame.error):
+                del self.files[idx]
+                continue
+            entry = (thumb, filename, self.font.render(self.fix_text(filename), True, (255, 255, 255)))
+            self.thumbs[filename] = entry
+            return entry
+        return None
+
+    def prefetch(self, idx):
+        # Prepare one missing thumbnail next to the shown motive, so browsing does not wait for it
+        for i in (idx + 1, idx - 1):
+            if self.files and self.files[i % len(self.files)] not in self.thumbs:
+                self.get(i)
+                return
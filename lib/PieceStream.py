@@ -1,85 +1,155 @@
 import pygame
 from pygame.locals import *
 
+from lib.Geometry import PuzzleGeometry
+from lib.BlockList import BlockList
+from lib.Config import STREAM_COLUMNS
+
+# Left edge of the stream and of its scroll bar, the pieces of a row must fit between them
+STREAM_X = 685
+SCROLL_X = 786
+
+# Inertial wheel scrolling: speed added by one wheel step in slots per frame, and the speed kept each frame
+WHEEL_SPEED = 0.3
+FRICTION = 0.85
+
 class PieceStream(object):
-    def __init__(self, pieces, board_y, board_height):
+    def __init__(self, pieces, board_y, board_height, geometry=None, columns=STREAM_COLUMNS):
         # Initialize the piece stream with a list of pieces and its position
-        self.pieces = pieces  # List of puzzle pieces
-        self.rect = pygame.Rect(685, board_y + (board_height - (96 * 6)) // 2, 96, 96 * 6)  # Stream area
-        self.start = 0  # Index of the first piece in the visible page
-        self.scroll_box = pygame.Rect(786, self.rect.y, 9, self.rect.height)  # Scroll bar container
-        self.scroll = pygame.Rect(786, self.rect.y, 9, self.rect.height)  # Scroll bar
+        self.pieces = BlockList(pieces)  # Puzzle pieces in stream order
+        self.geometry = geometry or PuzzleGeometry()  # Grid and piece measurements
+        self.cell = self.geometry.size  # Size of one slot in the stream
+        fit = max(1, (SCROLL_X - STREAM_X) // self.cell)  # Most slots in a row that stay clear of the scroll bar
+        self.columns = min(columns, fit) if columns else fit  # Number of slots in a row, as many as fit if not given
+        self.page_size = (96 * 6) // self.cell  # Number of rows visible at once
+        height = self.cell * self.page_size
+        self.rect = pygame.Rect(STREAM_X, board_y + (board_height - height) // 2, self.cell * self.columns, height)  # Stream area
+        self.offset = 0.0  # Scroll position in pixels from the top of the first row
+        self.velocity = 0.0  # Inertial scroll speed in pixels per frame
+        self.start = 0  # Index of the first visible piece
+        self.scroll_box = pygame.Rect(SCROLL_X, self.rect.y, 9, self.rect.height)  # Scroll bar container
+        self.scroll = pygame.Rect(SCROLL_X, self.rect.y, 9, self.rect.height)  # Scroll bar
         self.scroll_mod = 0  # Offset for scrolling
         self.scrolling = False  # Whether the stream is being scrolled
-        self._update()  # Update the stream to initialize positions
+        self.version = 0  # Counter bumped on every layout change, tells the renderer to redraw the stream
+        self.page = []  # Pieces at least partly inside the stream area
+        self.top = None  # Whole-pixel scroll position the page was placed at
+        self.changed = True  # Whether the layout must be computed again before it is used
+        self.layout()  # Initialize the positions
+
+    def _content_height(self):
+        # Return the height of all rows of pieces
+        return -(-len(self.pieces) // self.columns) * self.cell
+
+    def _clamp(self, offset):
+        # Return the scroll position moved into the range that keeps the stream area filled when possible
+        return max(0.0, min(float(offset), float(self._content_height() - self.rect.height)))
+
+    def _scroll_to(self, offset):
+        # Move the scroll position, marking the layout only if it changed
+        offset = self._clamp(offset)
+        if offset != self.offset:
+            self.offset = offset
+            self._update()
 
     def _update(self):
-        # Update the visible pieces and scroll bar position
-        size = len(self.pieces)
-        if size <= 6:
-            self.start = 0  # Reset start index if fewer than 6 pieces
-        else:
-            if size - self.start < 6:
-                self.start = size - 6  # Adjust start index if fewer pieces remain
-        if self.start < 0:
-            self.start = 0  # Ensure start index is not negative
+        # Mark the layout as outdated, it is computed once when next needed
+        self.changed = True
+
+    def layout(self):
+        # Update the visible pieces and scroll bar position if the stream changed since the last layout
+        if not self.changed:
+            return
+        self.changed = False
+        self.offset = self._clamp(self.offset)  # Removed pieces may leave the stream area short
+        top = int(self.offset)
 
         # Calculate scroll bar position and size
-        if size <= 6:
+        content = self._content_height()
+        if content <= self.rect.height:
             s = 5
             e = 590
         else:
-            p = 590.0 / float(size)  # Proportional height of the scroll bar
-            s = (self.start * p) + 5
-            e = (6.0 * p) + 1
-
+            p = 590.0 / float(content)  # Proportional height of the scroll bar
+            s = (top * p) + 5
+            e = (self.rect.height * p) + 1
+        scroll = (self.scroll.y, self.scroll.h)
         self.scroll.y = s
         self.scroll.h = e + 150  # Adjust scroll bar height
 
-        # Update the positions of visible pieces
-        y = self.rect.y
-        for p in self.get_page():
-            p.set_pos(self.rect.x, y)
-            y += 96
+        # Only the rows intersecting the stream area are laid out
+        first_row = top // self.cell
+        last_row = (top + self.rect.height - 1) // self.cell
+        self.start = first_row * self.columns
+        pieces = self.pieces.slice(self.start, (last_row + 1) * self.columns)
+        for i, p in enumerate(pieces):
+            row, col = divmod(self.start + i, self.columns)
+            p.set_pos(self.rect.x + col * self.cell, self.rect.y + row * self.cell - top)
+
+        # Tell the renderer only if the stream looks different now
+        if pieces != self.page or scroll != (self.scroll.y, self.scroll.h) or top != self.top:
+            self.page = pieces
+            self.top = top
+            self.version += 1
+
+    def tick(self):
+        # Advance the inertial scrolling by one frame
+        if self.velocity:
+            self._scroll_to(self.offset + self.velocity)
+            self.velocity *= FRICTION
+            if abs(self.velocity) < 0.5 or self.offset in (0.0, self._clamp(float("inf"))):
+                self.velocity = 0.0  # Stop when slow or at either end
+
+    def fling(self, direction):
+        # Speed up the inertial scrolling by one wheel step, down for a positive direction
+        if self.scrolling:
+            return
+        if self.velocity * direction < 0:
+            self.velocity = 0.0  # Turning the wheel the other way stops first
+        self.velocity += direction * WHEEL_SPEED * self.cell
 
     def down(self, cnt=1):
-        # Scroll down by a specified number of pieces
+        # Scroll down by a specified number of rows
         if self.scrolling:
             return
-        self.start += cnt
-        self._update()
+        self.velocity = 0.0
+        self._scroll_to(self.offset + cnt * self.cell)
 
     def up(self, cnt=1):
-        # Scroll up by a specified number of pieces
+        # Scroll up by a specified number of rows
         if self.scrolling:
             return
-        self.start -= cnt
-        self._update()
+        self.velocity = 0.0
+        self._scroll_to(self.offset - cnt * self.cell)
 
     def get_page(self):
-        # Get the current visible page of pieces
-        return self.pieces[self.start:][:6]
+        # Get the pieces at least partly inside the stream area
+        self.layout()
+        return self.page
 
     def is_scroll_hit(self, pos):
         # Check if the scroll bar or scroll box is clicked
+        self.layout()
         if self.scroll.collidepoint(pos):
             self.scrolling = True
+            self.velocity = 0.0
             self.scroll_mod = pos[1] - self.scroll.top  # Calculate scroll offset
             return True
         else:
             if self.scroll_box.collidepoint(pos):
                 # Scroll up or down based on click position
                 if pos[1] < self.scroll.top:
-                    self.up(6)
+                    self.up(self.page_size)
                 else:
-                    self.down(6)
+                    self.down(self.page_size)
         return False
 
     def do_scroll(self, pos):
         # Perform scrolling based on mouse position
-        p = 590.0 / float(len(self.pieces))  # Proportional scroll step
-        self.start = int(round((float(pos[1] - self.scroll_mod) - 5.0) / p))
-        self._update()
+        if not len(self.pieces):
+            return
+        p = 590.0 / float(self._content_height())  # Proportional scroll step
+        self._scroll_to(int((float(pos[1] - self.scroll_mod) - 5.0) / p))  # Whole pixels, motion within one changes nothing
 
     def stop_scroll(self):
         # Stop scrolling
@@ -109,7 +179,7 @@ class PieceStream(object):
 
     def get_piece_at(self, pos):
         # Get the piece at a specific position
-        if self.scrolling:
+        if self.scrolling or not self.rect.collidepoint(pos):
             return None
         for p in self.get_page():
             if p.is_hit(pos):  # Check if the position hits a piece
@@ -118,8 +188,12 @@ class PieceStream(object):
 
     def draw(self, dest):
         # Draw the stream and its pieces
+        self.layout()
         dest.fill((255, 255, 255), self.scroll)  # Draw the scroll bar
 
-        for p in self.get_page():
-            p.draw_shadow(dest)  # Draw the shadow of each piece
-            p.draw(dest)  # Draw the piece itself
\ No newline at end of file
+        # Pieces scrolled partly out of the stream area are cut at its edges, shadows may reach up to the scroll bar
+        clip = dest.get_clip()
+        dest.set_clip(clip.clip(self.rect.x, self.rect.y, min(self.rect.w + 3, self.scroll_box.x - self.rect.x), self.rect.h))
+        for p in self.page:
+            p.draw_with_shadow(dest)  # Draw each piece over its shadow
+        dest.set_clip(clip)
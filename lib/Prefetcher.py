@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.Loader import Loader
+from lib.Geometry import PuzzleGeometry
+
+# Single background thread loading motives ahead of the loading screen
+_executor = None
+
+def get_executor():
+    # Return the thread pool used for prefetching
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+    return _executor
+
+class MotivePrefetcher(object):
+    def __init__(self, loader=None, geometry=None):
+        # Initialize the prefetcher without a pending motive
+        self.loader = loader or Loader()  # Resource loader, its cache is shared with the loading screen
+        self.geometry = geometry or PuzzleGeometry()  # Grid size deciding the motive size
+        self.filename = None  # Motive being prefetched
+        self.future = None  # Future of the scaled motive
+
+    def _load(self, filename):
+        # Load the piece templates and the motive scaled to the board, run in the background thread
+        for name in ("piece_mask.png", "piece_bevel.png", "piece_shadow.png"):
+            self.loader.load_image(name)
+        return self.loader.load_motive(filename, (self.geometry.width, self.geometry.height))
+
+    def request(self, filename):
+        # Start loading a motive in the background unless it is already being loaded
+        if filename == self.filename:
+            return
+        if self.future is not None:
+            self.future.cancel()  # Skip the previous motive if its load has not started yet
+        self.filename = filename
+        self.future = get_executor().submit(self._load, filename)
+
+    def take(self, filename):
+        # Return the future of a prefetched motive and forget it, or None if another motive was prefetched
+        future = self.future if filename == self.filename else None
+        self.filename = None
+        self.future = None
+        return future
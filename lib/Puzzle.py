@@ -1,112 +1,150 @@
 import pygame
 from pygame.locals import *
-from random import choice, shuffle
+from random import Random, randrange
+import base64
+import binascii
+import hashlib
+import os
+import atexit
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from lib.Geometry import PuzzleGeometry
+from lib.Config import BAKED_SPRITES
 
 class PuzzlePieceGroup(object):
     def __init__(self, piece):
         # Initialize a group of puzzle pieces with a single piece
+        self.geometry = piece.geometry  # Grid and piece measurements
         self.pieces = [piece]
+        self.grid = {(piece.px, piece.py): piece}  # Members by grid position
+
+        # Position of grid position (0, 0), the rects of the members are derived from it when needed
+        self.x = piece.rect.x - piece.px * self.geometry.tile
+        self.y = piece.rect.y - piece.py * self.geometry.tile
+
+        self.bounds = [piece.px, piece.py, piece.px, piece.py]  # Smallest and largest member grid positions
 
     def is_piece(self):
         # Return False since this is a group of pieces
         return False
 
     def append(self, piece):
-        # Add a piece or group of pieces to this group
+        # Add a piece or group of pieces to this group, snapping them to the grid of this group
         if piece.is_piece():
             self.pieces.append(piece)
-            op = self.pieces[0]
-            p = piece
-            # Adjust the position of the new piece relative to the group
-            p.rect.x = op.rect.x + ((p.px - op.px) * 64)
-            p.rect.y = op.rect.y + ((p.py - op.py) * 64)
+            self.grid[(piece.px, piece.py)] = piece
+            bounds = (piece.px, piece.py, piece.px, piece.py)
         else:
-            for p in piece.pieces:
-                self.append(p)
-
-    def is_friend(self, piece):
-        # Check if the given piece can be joined with this group
-        if piece.is_piece():
-            for p in self.pieces:
-                if p.is_friend(piece):
-                    return True
-            return False
-        else:
-            for p in piece.pieces:
-                if self.is_friend(p):
-                    return True
-            return False
+            # Move the members of the smaller group into the member lists of the larger one
+            if len(piece.pieces) > len(self.pieces):
+                self.pieces, piece.pieces = piece.pieces, self.pieces
+                self.grid, piece.grid = piece.grid, self.grid
+            self.pieces.extend(piece.pieces)
+            self.grid.update(piece.grid)
+            bounds = piece.bounds
+        self.bounds = [min(self.bounds[0], bounds[0]), min(self.bounds[1], bounds[1]),
+                       max(self.bounds[2], bounds[2]), max(self.bounds[3], bounds[3])]
+
+    def get_piece_pos(self, piece):
+        # Return the top-left position of a member piece
+        tile = self.geometry.tile
+        return (self.x + piece.px * tile, self.y + piece.py * tile)
+
+    def get_rect(self):
+        # Return the rectangle covering every member piece
+        g = self.geometry
+        x0, y0, x1, y1 = self.bounds
+        return pygame.Rect(self.x + x0 * g.tile, self.y + y0 * g.tile,
+                           (x1 - x0) * g.tile + g.size, (y1 - y0) * g.tile + g.size)
+
+    def sync(self):
+        # Write the derived position of every member into its rect
+        for p in self.pieces:
+            p.rect.topleft = self.get_piece_pos(p)
 
     def is_hit(self, pos):
-        # Check if the given position hits any piece in the group
-        for p in self.pieces:
-            if p.is_hit(pos):
-                return True
+        # Check if the given position hits a member, testing only the pieces around the grid position under it
+        g = self.geometry
+        cx = (pos[0] - self.x - g.margin) // g.tile
+        cy = (pos[1] - self.y - g.margin) // g.tile
+        for px in (cx - 1, cx, cx + 1):
+            for py in (cy - 1, cy, cy + 1):
+                p = self.grid.get((px, py))
+                if p is None:
+                    continue
+                x = pos[0] - self.x - px * g.tile
+                y = pos[1] - self.y - py * g.tile
+                if 0 <= x < g.size and 0 <= y < g.size and p.hit_mask.get_at((x, y)):
+                    return True
         return False
 
     def translate(self, rel):
-        # Move all pieces in the group by a relative offset
-        for p in self.pieces:
-            p.translate(rel)
+        # Move the group by a relative offset
+        self.x += rel[0]
+        self.y += rel[1]
 
     def draw(self, dest):
         # Draw all pieces in the group
         for p in self.pieces:
-            p.draw(dest)
+            dest.blit(p.img, self.get_piece_pos(p))
 
     def draw_shadow(self, dest, pos=3):
         # Draw shadows for all pieces in the group
         for p in self.pieces:
-            p.draw_shadow(dest, pos)
+            x, y = self.get_piece_pos(p)
+            dest.blit(p.simg, (x + pos, y + pos))
+
+    def draw_with_shadow(self, dest, pos=3):
+        # Draw the group over its shadows, which must all lie below the interlocking pieces
+        self.draw_shadow(dest, pos)
+        self.draw(dest)
 
 class PuzzlePiece(object):
-    def __init__(self, image, shadow, x, y, px, py):
+    def __init__(self, image, shadow, x, y, px, py, geometry=None, hit_mask=None):
         # Initialize a single puzzle piece with its image, shadow, and position
         self.px = px  # Grid x-coordinate
         self.py = py  # Grid y-coordinate
+        self.geometry = geometry or PuzzleGeometry()  # Grid and piece measurements
 
         self.img = image  # Piece image
+        if hit_mask is None:
+            hit_mask = pygame.mask.from_surface(image, 254)  # Fully opaque pixels of this image
+        self.hit_mask = hit_mask  # Pixels that react to clicks, shared by pieces with the same form
         self.rect = self.img.get_rect()
         self.rect.center = (x, y)
 
         self.simg = shadow  # Shadow image
         self.srect = self.simg.get_rect()
         self.srect.center = (x + 3, y + 3)
+        self.sprites = {}  # Piece images with the shadow baked in, keyed by shadow offset
 
     def is_piece(self):
         # Return True since this is a single piece
         return True
 
-    def is_friend(self, piece):
-        # Check if the given piece can be joined with this piece
-        if not piece.is_piece():
-            return piece.is_friend(self)
-
-        # Check adjacency and alignment
-        if self.px + 1 == piece.px and self.py == piece.py:
-            if abs(piece.rect.x - (self.rect.x + 64)) <= 10 and abs(piece.rect.y - self.rect.y) <= 10:
-                return True
-        elif self.px - 1 == piece.px and self.py == piece.py:
-            if abs(piece.rect.x - (self.rect.x - 64)) <= 10 and abs(piece.rect.y - self.rect.y) <= 10:
-                return True
-        elif self.px == piece.px and self.py + 1 == piece.py:
-            if abs(piece.rect.x - self.rect.x) <= 10 and abs(piece.rect.y - (self.rect.y + 64)) <= 10:
-                return True
-        elif self.px == piece.px and self.py - 1 == piece.py:
-            if abs(piece.rect.x - self.rect.x) <= 10 and abs(piece.rect.y - (self.rect.y - 64)) <= 10:
-                return True
-        return False
-
     def is_hit(self, pos):
         # Check if the given position hits this piece
         if self.rect.collidepoint(pos):
             x = pos[0] - self.rect.left
             y = pos[1] - self.rect.top
-            col = self.img.get_at((x, y))
-            if col[3] == 255:  # Check if the pixel is not transparent
+            if self.hit_mask.get_at((x, y)):  # Check if the pixel is not transparent
                 return True
         return False
 
+    def overlaps(self, piece):
+        # Check if the opaque pixels of this piece overlap those of another piece
+        offset = (piece.rect.x - self.rect.x, piece.rect.y - self.rect.y)
+        return self.hit_mask.overlap(piece.hit_mask, offset) is not None
+
+    def get_piece_pos(self, piece):
+        # Return the top-left position of the piece
+        return self.rect.topleft
+
+    def get_rect(self):
+        # Return the rectangle covered by the piece
+        return self.rect
+
     def set_pos(self, x, y):
         # Set the position of the piece
         self.rect.x = x
@@ -127,6 +165,25 @@ class PuzzlePiece(object):
         self.srect.y = self.rect.y + pos
         dest.blit(self.simg, self.srect.topleft)
 
+    def get_sprite(self, pos=3):
+        # Return the piece image over its shadow at the given offset, baking it on first use
+        sprite = self.sprites.get(pos)
+        if sprite is None:
+            w, h = self.img.get_size()
+            sprite = _new_surface((w + pos, h + pos))
+            sprite.blit(self.simg, (pos, pos))
+            sprite.blit(self.img, (0, 0))
+            self.sprites[pos] = sprite
+        return sprite
+
+    def draw_with_shadow(self, dest, pos=3):
+        # Draw the piece over its shadow, as one blit if baked sprites are enabled
+        if BAKED_SPRITES:
+            dest.blit(self.get_sprite(pos), self.rect.topleft)
+        else:
+            self.draw_shadow(dest, pos)
+            self.draw(dest)
+
 # Constants for edge types
 PEG = 0
 HOLE = 1
@@ -138,26 +195,109 @@ RIGHT = 1
 BOTTOM = 2
 LEFT = 3
 
+def _new_surface(size):
+    # Create a transparent surface, converted to the display format when a display is set
+    res = pygame.Surface(size, pygame.SRCALPHA)
+    if pygame.display.get_surface() is not None:
+        res = res.convert_alpha()
+    res.fill((0, 0, 0, 0))
+    return res
+
+class FormAtlas(object):
+    def __init__(self, mask_image, bevel_image, shadow_image, size=96):
+        # Initialize an empty atlas of piece forms built from the edge templates, scaled to the piece size
+        self.size = size  # Size of a piece form
+        self.mask_img = self._scale(mask_image, pygame.transform.scale)  # Mask for cutting pieces, kept binary
+        self.bevel_img = self._scale(bevel_image)  # Bevel effect for pieces
+        self.shadow_img = self._scale(shadow_image)  # Shadow effect for pieces
+        self.forms = {}  # Forms keyed by the (top, right, bottom, left) edge tuple
+
+    def _scale(self, img, scale=pygame.transform.smoothscale):
+        # Scale a template holding three edge variants side by side to the piece size
+        if img.get_height() == self.size:
+            return img
+        return scale(img, (3 * self.size, self.size))
+
+    def _make_form(self, img, edges):
+        # Create a piece form based on its edges
+        top, right, bottom, left = edges
+        s = self.size
+        m = s // 6  # Peg margin, the tile is 4 margins wide
+
+        res = _new_surface((s, s))
+
+        center = pygame.Rect(2 * m, 2 * m, 2 * m, 2 * m)
+        top_r = pygame.Rect(m + s * top, 0, 4 * m, 2 * m)
+        bottom_r = pygame.Rect(m + s * bottom, 4 * m, 4 * m, 2 * m)
+        right_r = pygame.Rect(4 * m + s * right, 2 * m, 2 * m, 2 * m)
+        left_r = pygame.Rect(0 + s * left, 2 * m, 2 * m, 2 * m)
+
+        res.blit(img, center, center)
+        res.blit(img, (m, 0), top_r)
+        res.blit(img, (m, 4 * m), bottom_r)
+        res.blit(img, (0, 2 * m), left_r)
+        res.blit(img, (4 * m, 2 * m), right_r)
+        return res
+
+    def get(self, edges):
+        # Return the cutting mask, bevel, shadow and hit mask for the given edges, building them only once
+        forms = self.forms.get(edges)
+        if forms is None:
+            mask = self._make_form(self.mask_img, edges)
+            opaque = pygame.mask.from_surface(mask, 254)  # Fully opaque pixels of the mask
+            bevel = self._make_form(self.bevel_img, edges)
+
+            # Cut an opaque dummy piece to find the pixels every piece of an opaque motive can be clicked on
+            dummy = opaque.to_surface(_new_surface((self.size, self.size)), unsetcolor=(0, 0, 0, 0))
+            dummy.blit(bevel, (0, 0))
+
+            forms = (opaque, bevel, self._make_form(self.shadow_img, edges), pygame.mask.from_surface(dummy, 254))
+            self.forms[edges] = forms
+        return forms
+
+# Atlases shared by every puzzle in the process, keyed by the template pixels
+_atlases = {}
+
+def get_form_atlas(mask_image, bevel_image, shadow_image, size=96):
+    # Return the shared form atlas for the given templates and piece size, creating it on first use
+    key = hashlib.md5()
+    for img in (mask_image, bevel_image, shadow_image):
+        key.update(pygame.image.tobytes(img, "RGBA"))
+    key = (key.hexdigest(), size)
+    if key not in _atlases:
+        _atlases[key] = FormAtlas(mask_image, bevel_image, shadow_image, size)
+    return _atlases[key]
+
 class PuzzleFactory(object):
-    def __init__(self, image, mask_image, bevel_image, shadow_image):
+    def __init__(self, image, mask_image, bevel_image, shadow_image, seed=None, edge_code=None, geometry=None):
         # Initialize the puzzle factory with images for pieces and edges
-        self.img = (pygame.Surface((640 + 32, 512 + 32), pygame.SRCALPHA)).convert_alpha()
+        self.geometry = geometry or PuzzleGeometry()  # Grid and piece measurements
+        g = self.geometry
+        self.img = (pygame.Surface((g.width + 2 * g.margin, g.height + 2 * g.margin), pygame.SRCALPHA)).convert_alpha()
         self.img.fill((0, 0, 0, 0))
-        self.img.blit(image, (16, 16))
-
-        self.mask_img = mask_image  # Mask for cutting pieces
-        self.bevel_img = bevel_image  # Bevel effect for pieces
-        self.shadow_img = shadow_image  # Shadow effect for pieces
-
-        self._setup_edges()  # Generate random edges for the puzzle
+        self.img.blit(image, (g.margin, g.margin))
+
+        self.forms = get_form_atlas(mask_image, bevel_image, shadow_image, g.size)  # Shared piece forms
+        self.opaque = is_opaque(image)  # Whether pieces can share the hit masks of their forms
+
+        if seed is None:
+            seed = randrange(2 ** 32)
+        self.seed = seed  # Seed the edges and the piece order are generated from
+        if edge_code:
+            self.edges = decode_edges(edge_code)  # Use a shared edge table
+            if len(self.edges) != g.rows or len(self.edges[0]) != g.cols:
+                raise ValueError("The edge table does not match a %dx%d puzzle" % (g.cols, g.rows))
+        else:
+            self._setup_edges()  # Generate random edges for the puzzle
 
     def _setup_edges(self):
         # Generate random edges for all puzzle pieces
+        rnd = Random(self.seed)
         self.edges = []
-        for y in range(8):
+        for y in range(self.geometry.rows):
             row = []
             self.edges.append(row)
-            for x in range(10):
+            for x in range(self.geometry.cols):
                 # Set top edge
                 if y == 0:
                     top = EDGE
@@ -167,10 +307,10 @@ class PuzzleFactory(object):
                     else:
                         top = PEG
                 # Set bottom edge
-                if y == 7:
+                if y == self.geometry.rows - 1:
                     bottom = EDGE
                 else:
-                    bottom = choice((PEG, HOLE))
+                    bottom = rnd.choice((PEG, HOLE))
                 # Set left edge
                 if x == 0:
                     left = EDGE
@@ -180,59 +320,161 @@ class PuzzleFactory(object):
                     else:
                         left = PEG
                 # Set right edge
-                if x == 9:
+                if x == self.geometry.cols - 1:
                     right = EDGE
                 else:
-                    right = choice((PEG, HOLE))
+                    right = rnd.choice((PEG, HOLE))
                 row.append((top, right, bottom, left))
 
-    def _make_form(self, img, edges):
-        # Create a piece form based on its edges
-        top, right, bottom, left = edges
-
-        res = (pygame.Surface((96, 96), pygame.SRCALPHA)).convert_alpha()
-        res.fill((0, 0, 0, 0))
-
-        center = pygame.Rect(32, 32, 32, 32)
-        top_r = pygame.Rect(16 + 96 * top, 0, 64, 32)
-        bottom_r = pygame.Rect(16 + 96 * bottom, 64, 64, 32)
-        right_r = pygame.Rect(64 + 96 * right, 32, 32, 32)
-        left_r = pygame.Rect(0 + 96 * left, 32, 32, 32)
-
-        res.blit(img, center, center)
-        res.blit(img, (16, 0), top_r)
-        res.blit(img, (16, 64), bottom_r)
-        res.blit(img, (0, 32), left_r)
-        res.blit(img, (64, 32), right_r)
-        return res
-
     def _make_piece(self, px, py):
         # Create a single puzzle piece at the given grid position
-        r = pygame.Rect(px * 64, py * 64, 96, 96)
+        g = self.geometry
+        r = pygame.Rect(px * g.tile, py * g.tile, g.size, g.size)
         src = self.img.subsurface(r)
-
-        mask = self._make_form(self.mask_img, self.edges[py][px])
-        bevel = self._make_form(self.bevel_img, self.edges[py][px])
-        shadow = self._make_form(self.shadow_img, self.edges[py][px])
-
-        dest = (pygame.Surface((96, 96), pygame.SRCALPHA)).convert_alpha()
-        dest.fill((0, 0, 0, 0))
-
-        for y in range(96):
-            for x in range(96):
-                m = mask.get_at((x, y))
-                if m[3] == 255:  # Only copy pixels within the mask
-                    dest.set_at((x, y), src.get_at((x, y)))
-
-        dest.blit(bevel, (0, 0))
-
-        return PuzzlePiece(dest, shadow, 40 + 64 * px, 40 + 64 * py, px, py)
-
-    def get_pieces(self):
-        # Generate and return all puzzle pieces
+        dest = _cut_piece(src, self.forms, self.edges[py][px])
+
+        return make_piece(dest, self.forms, self.edges[py][px], px, py, g, self.opaque)
+
+    def make_piece_from_data(self, data):
+        # Rebuild a puzzle piece from the raw data returned by a worker process
+        px, py, edges, buf = data
+        g = self.geometry
+        dest = pygame.image.frombytes(buf, (g.size, g.size), "RGBA").convert_alpha()
+
+        return make_piece(dest, self.forms, edges, px, py, g, self.opaque)
+
+    def submit_rows(self, pool):
+        # Queue every row of the grid on the process pool and return one future per row
+        g = self.geometry
+        templates = [(pygame.image.tobytes(img, "RGBA"), img.get_size())
+                     for img in (self.forms.mask_img, self.forms.bevel_img, self.forms.shadow_img)]
+        futures = []
+        for py in range(g.rows):
+            strip = self.img.subsurface(pygame.Rect(0, py * g.tile, self.img.get_width(), g.size))
+            futures.append(pool.submit(
+                _cut_row, pygame.image.tobytes(strip, "RGBA"), strip.get_size(),
+                templates, self.edges[py], py
+            ))
+        return futures
+
+    def get_pieces(self, parallel=False):
+        # Generate and return all puzzle pieces, optionally cutting rows in worker processes
         p = []
-        for y in range(8):
-            for x in range(10):
-                p.append(self._make_piece(x, y))
-        shuffle(p)  # Shuffle the pieces randomly
-        return p
\ No newline at end of file
+        if parallel:
+            for f in self.submit_rows(get_pool()):
+                for data in f.result():
+                    p.append(self.make_piece_from_data(data))
+        else:
+            for y in range(self.geometry.rows):
+                for x in range(self.geometry.cols):
+                    p.append(self._make_piece(x, y))
+        p.sort(key=lambda piece: (piece.py, piece.px))  # Same order no matter how the pieces were cut
+        Random(self.seed).shuffle(p)  # Shuffle the pieces reproducibly
+        return p
+
+    def get_edge_code(self):
+        # Return the compact serialized edge table of this puzzle
+        return encode_edges(self.edges)
+
+def encode_edges(edges):
+    # Serialize an edge table as "COLSxROWS:" plus the base64 bits of its inner right and bottom edges
+    rows = len(edges)
+    cols = len(edges[0])
+    bits = []
+    for y in range(rows):
+        for x in range(cols):
+            if x < cols - 1:
+                bits.append(edges[y][x][RIGHT])
+            if y < rows - 1:
+                bits.append(edges[y][x][BOTTOM])
+    data = bytearray((len(bits) + 7) // 8)
+    for i, b in enumerate(bits):
+        if b == HOLE:
+            data[i // 8] |= 1 << (i % 8)
+    return "%dx%d:%s" % (cols, rows, base64.urlsafe_b64encode(bytes(data)).decode("ascii").rstrip("="))
+
+def decode_edges(code):
+    # Rebuild an edge table from the string produced by encode_edges, raising ValueError if it is malformed
+    size, sep, data = code.partition(":")
+    cols, x, rows = size.partition("x")
+    if not sep or not x or not cols.isdigit() or not rows.isdigit() or not int(cols) or not int(rows):
+        raise ValueError("edge table must start with COLSxROWS:, got %r" % code)
+    cols, rows = int(cols), int(rows)
+    try:
+        data = base64.b64decode(data + "=" * (-len(data) % 4), altchars=b"-_", validate=True)
+    except binascii.Error:
+        raise ValueError("edge table data is not valid base64")
+    count = rows * (cols - 1) + cols * (rows - 1)  # Inner right and bottom edges
+    if len(data) != (count + 7) // 8:
+        raise ValueError("edge table of a %dx%d puzzle needs %d bytes of data, got %d" % (cols, rows, (count + 7) // 8, len(data)))
+    bits = iter([(data[i // 8] >> (i % 8)) & 1 for i in range(len(data) * 8)])
+
+    edges = []
+    for y in range(rows):
+        row = []
+        edges.append(row)
+        for x in range(cols):
+            # Inner edges mirror the neighbors above and to the left
+            top = EDGE if y == 0 else (HOLE if edges[y - 1][x][BOTTOM] == PEG else PEG)
+            left = EDGE if x == 0 else (HOLE if row[x - 1][RIGHT] == PEG else PEG)
+            right = EDGE if x == cols - 1 else (HOLE if next(bits) else PEG)
+            bottom = EDGE if y == rows - 1 else (HOLE if next(bits) else PEG)
+            row.append((top, right, bottom, left))
+    return edges
+
+def is_opaque(image):
+    # Check if every pixel of an image is fully opaque
+    w, h = image.get_size()
+    return pygame.mask.from_surface(image, 254).count() == w * h
+
+def make_piece(img, forms, edges, px, py, geometry, opaque):
+    # Create a piece from its cut image, sharing the shadow and, for opaque motives, the hit mask of its form
+    _, _, shadow, hit_mask = forms.get(edges)
+    return PuzzlePiece(img, shadow, *geometry.piece_center(px, py), px, py, geometry, hit_mask if opaque else None)
+
+def _cut_piece(src, forms, edges):
+    # Cut a piece image out of a source area of the piece size using the forms for its edges
+    opaque, bevel, _, _ = forms.get(edges)
+
+    # Copy only the pixels that are fully opaque in the mask in a single pass
+    dest = _new_surface((forms.size, forms.size))
+    opaque.to_surface(dest, setsurface=src, unsetcolor=(0, 0, 0, 0))
+
+    dest.blit(bevel, (0, 0))
+    return dest
+
+def _cut_row(strip_data, strip_size, templates, edges, py):
+    # Cut one row of pieces in a worker process and return picklable raw RGBA buffers
+    strip = pygame.image.frombytes(strip_data, strip_size, "RGBA")
+    strip = strip.convert(_new_surface((1, 1)))  # Match the pixel format of the cut pieces
+    size = strip_size[1]
+    forms = get_form_atlas(*[pygame.image.frombytes(d, s, "RGBA") for d, s in templates], size)
+    tile = size * 2 // 3
+    res = []
+    for px in range(len(edges)):
+        src = strip.subsurface(pygame.Rect(px * tile, 0, size, size))
+        dest = _cut_piece(src, forms, edges[px])
+        res.append((px, py, edges[px], pygame.image.tobytes(dest, "RGBA")))
+    return res
+
+# Process pool shared by every puzzle, created on first use
+_pool = None
+
+def get_pool():
+    # Return the process pool used for parallel piece cutting
+    global _pool
+    if _pool is None:
+        os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")  # Keep worker processes quiet
+        # The prefetch and database threads are running by now, forking a process with threads can deadlock the child
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _pool = ProcessPoolExecutor(mp_context=multiprocessing.get_context(method))
+    return _pool
+
+def shutdown_pool():
+    # Stop the worker processes, dropping rows that have not been started, a new pool is created when needed
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+atexit.register(shutdown_pool)  # Workers must not outlive the game
@@ -0,0 +1,133 @@
+import pygame
+from pygame.locals import *
+from os import path
+import hashlib
+import mmap
+import os
+import struct
+
+from lib.Puzzle import is_opaque, make_piece
+
+# Layout of a cache file: header, one index record per piece, the packed RGBA piece atlas, the RGBA motive
+HEADER = struct.Struct("<4sHHHHHHHH")  # Magic, version, columns, rows, piece size, count, atlas columns, motive size
+RECORD = struct.Struct("<HHBBBBHH")  # Grid position, edges and atlas position of a piece
+MAGIC = b"PZC1"
+VERSION = 2  # Bumped when cut pieces change, older files are treated as misses
+
+class PuzzleCache(object):
+    def __init__(self, cache_dir=path.join("data", "cache", "puzzles"), max_bytes=64 * 1024 * 1024):
+        # Initialize the cache directory and its size limit
+        self.cache_dir = cache_dir  # Directory holding the cut puzzles
+        self.max_bytes = max_bytes  # Total size allowed before old puzzles are evicted
+        self.hashes = {}  # Motive file hashes keyed by (path, mtime, size)
+
+    def _hash_file(self, file_path):
+        # Hash the contents of a motive file, reusing the result while the file is unchanged
+        st = os.stat(file_path)
+        stamp = (file_path, st.st_mtime, st.st_size)
+        if stamp not in self.hashes:
+            with open(file_path, "rb") as f:
+                self.hashes[stamp] = hashlib.sha1(f.read()).hexdigest()
+        return self.hashes[stamp]
+
+    def make_key(self, motive_file, size, seed):
+        # Build the cache key from the motive file hash, board size (columns, rows, tile) and edge seed or edge table digest
+        cols, rows, tile = size
+        return "%s_%dx%dx%d_%s" % (self._hash_file(motive_file), cols, rows, tile, seed)
+
+    def _file(self, key):
+        # Return the path of the cache file for a key
+        return path.join(self.cache_dir, key + ".pzc")
+
+    def load(self, key, forms, geometry):
+        # Load a cut puzzle with a single memory-mapped read, returning (image, pieces, edges) or None
+        file_path = self._file(key)
+        if not path.exists(file_path):
+            return None
+
+        try:
+            with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, version, cols, rows, size, count, atlas_cols, img_w, img_h = HEADER.unpack_from(mm, 0)
+                if magic != MAGIC or version != VERSION:
+                    return None
+                records = [RECORD.unpack_from(mm, HEADER.size + i * RECORD.size) for i in range(count)]
+
+                offset = HEADER.size + count * RECORD.size
+                atlas_size = (atlas_cols * size, ((count + atlas_cols - 1) // atlas_cols) * size)
+                atlas_len = atlas_size[0] * atlas_size[1] * 4
+                atlas = pygame.image.frombytes(mm[offset:offset + atlas_len], atlas_size, "RGBA").convert_alpha()
+                offset += atlas_len
+                image = pygame.image.frombytes(mm[offset:offset + img_w * img_h * 4], (img_w, img_h), "RGBA").convert_alpha()
+        except (OSError, ValueError, struct.error):
+            return None  # Treat unreadable or truncated files as a cache miss
+
+        os.utime(file_path)  # Mark the puzzle as recently used
+
+        # Rebuild the pieces as views into the atlas
+        opaque = is_opaque(image)
+        edges = [[None] * cols for _ in range(rows)]
+        pieces = []
+        for px, py, top, right, bottom, left, ax, ay in records:
+            edges[py][px] = (top, right, bottom, left)
+            img = atlas.subsurface(pygame.Rect(ax, ay, size, size))
+            pieces.append(make_piece(img, forms, edges[py][px], px, py, geometry, opaque))
+        return image, pieces, edges
+
+    def store(self, key, image, pieces, edges):
+        # Pack the pieces into one RGBA atlas and write it with its index to the cache
+        cols = len(edges[0])
+        rows = len(edges)
+        size = pieces[0].img.get_width()
+        atlas_cols = cols
+        atlas_w = atlas_cols * size
+        stride = atlas_w * 4
+        atlas = bytearray(stride * ((len(pieces) + atlas_cols - 1) // atlas_cols) * size)
+
+        index = []
+        for i, p in enumerate(sorted(pieces, key=lambda p: (p.py, p.px))):
+            ax = (i % atlas_cols) * size
+            ay = (i // atlas_cols) * size
+            index.append(RECORD.pack(p.px, p.py, *edges[p.py][p.px], ax, ay))
+
+            # Copy the piece row by row into its place in the atlas
+            buf = pygame.image.tobytes(p.img, "RGBA")
+            for y in range(size):
+                start = (ay + y) * stride + ax * 4
+                atlas[start:start + size * 4] = buf[y * size * 4:(y + 1) * size * 4]
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        file_path = self._file(key)
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, cols, rows, size, len(pieces), atlas_cols, *image.get_size()))
+            f.write(b"".join(index))
+            f.write(atlas)
+            f.write(pygame.image.tobytes(image, "RGBA"))
+        os.replace(tmp_path, file_path)  # Publish the file only once it is complete
+
+        self._evict()
+
+    def _evict(self):
+        # Delete the least recently used puzzles until the cache fits its size limit
+        files = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".pzc"):
+                st = os.stat(path.join(self.cache_dir, name))
+                files.append((st.st_mtime, st.st_size, name))
+                total += st.st_size
+        files.sort()
+        while total > self.max_bytes and len(files) > 1:
+            _, size, name = files.pop(0)
+            os.remove(path.join(self.cache_dir, name))
+            total -= size
+
+# Cache shared by every loading screen, so motive hashes are computed once per file
+_cache = None
+
+def get_cache(cache_dir=None):
+    # Return the shared puzzle cache, created in the given directory or the default one on first use
+    global _cache
+    if _cache is None:
+        _cache = PuzzleCache(cache_dir) if cache_dir else PuzzleCache()
+    return _cache
@@ -2,9 +2,11 @@ import time
 from lib.UserDatabase import UserDatabase
 
 class ScoreTable:
-    def __init__(self, user_name):
-        # Initialize the score table with the player's username
+    def __init__(self, user_name, motive=None, pieces=None):
+        # Initialize the score table with the player's username and the puzzle being played
         self.user_name = user_name
+        self.motive = motive  # File name of the puzzle motive
+        self.pieces = pieces  # Number of pieces in the puzzle
         self.start_time = time.time()  # Record the start time of the game
         self.end_time = None  # End time will be set when the game is completed
         self.score = 0  # Initial score
@@ -51,31 +53,9 @@ class ScoreTable:
         self.apply_time_bonus()  # Ensure the time bonus is applied
         elapsed_time = self.get_elapsed_time()
 
-        # Create the scores table if it doesn't exist
-        self.db.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS scores (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_name TEXT NOT NULL,
-                score INTEGER NOT NULL,
-                time REAL NOT NULL,
-                FOREIGN KEY (user_name) REFERENCES users (user_name) ON DELETE CASCADE
-            )
-        """)
-        self.db.connection.commit()
-
-        # Check the player's best score
-        self.db.cursor.execute("""
-            SELECT MAX(score) FROM scores WHERE user_name = ?
-        """, (self.user_name,))
-        best_score = self.db.cursor.fetchone()[0]
-
-        # Save the new score if it's better than the previous best
-        if best_score is None or self.score > best_score:
-            self.db.cursor.execute("""
-                INSERT INTO scores (user_name, score, time) VALUES (?, ?, ?)
-            """, (self.user_name, self.score, elapsed_time))
-            self.db.connection.commit()
+        # Save the new score if it's better than the player's previous best, without waiting for the disk
+        self.db.add_best_score(self.user_name, self.score, elapsed_time, self.motive, self.pieces)
 
     def close(self):
-        # Close the database connection
+        # Release the database
         self.db.close()
\ No newline at end of file
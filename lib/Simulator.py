@@ -0,0 +1,131 @@
+import pygame
+from pygame.locals import *
+from time import perf_counter
+
+from lib.GamePart import GamePart
+from lib.LoadPart import LoadPart
+from lib.Config import WINDOW_SIZE
+
+class Solver(object):
+    def __init__(self, part, group=3, steps=4):
+        # Initialize a scripted player that solves a game by sending it mouse and keyboard events
+        self.part = part  # Game being solved
+        self.geometry = part.board.geometry  # Grid and piece measurements
+        self.group = max(1, group)  # Number of pieces of a row joined into a group before it is dropped on the board
+        self.steps = max(1, steps)  # Mouse motion events of one drag
+        self.lift = 2 * self.geometry.snap + 1  # Height above the board a group is assembled at, too far to snap into place
+        self.pieces = dict(((p.px, p.py), p) for p in part.stream.pieces)  # Grid position mapped to its piece
+        self.script = self._script()  # Events of the remaining frames
+
+    def next_events(self):
+        # Return the events of the next frame, or None once the puzzle is solved
+        return next(self.script, None)
+
+    def _script(self):
+        # Yield the events of each frame, reading the game state only after the previous frame was updated
+        g = self.geometry
+        for py in range(g.rows):
+            for x in range(0, g.cols, self.group):
+                chunk = [self.pieces[(px, py)] for px in range(x, min(x + self.group, g.cols))]
+                if len(chunk) == 1:
+                    yield from self._pick(chunk[0], 0)
+                    continue
+
+                # Assemble the pieces above their places, then lower the whole group onto the board
+                for p in chunk:
+                    yield from self._pick(p, self.lift)
+                group = self.part.floating.owner(chunk[0])
+                x0, y0 = group.get_piece_pos(chunk[0])
+                yield from self._drag((x0 + g.size // 2, y0 + g.size // 2), (0, self.lift))
+                if group in self.part.floating:
+                    raise RuntimeError("Solver could not drop the group of piece %d,%d" % (chunk[0].px, chunk[0].py))
+
+    def _pick(self, piece, lift):
+        # Scroll a piece into view, then drag it from the stream to its place on the board raised by the lift
+        stream = self.part.stream
+        for _ in range(len(stream.pieces) + 1):
+            if piece in stream.get_page() and stream.rect.collidepoint(piece.rect.center):
+                break  # Pieces off the page keep stale positions
+            key = K_DOWN if stream.pieces.index(piece) >= stream.start else K_UP
+            yield [pygame.event.Event(KEYDOWN, key=key, mod=0, unicode="", scancode=0)]
+
+        g = self.geometry
+        destx = self.part.board.r.x + g.tile * piece.px - g.margin
+        desty = self.part.board.r.y + g.tile * piece.py - g.margin - lift
+        yield from self._drag(piece.rect.center, (destx - piece.rect.x, desty - piece.rect.y))
+        if piece in stream.pieces:
+            raise RuntimeError("Solver could not pick piece %d,%d" % (piece.px, piece.py))
+
+    def _drag(self, pos, delta):
+        # Press the left button at a position, move the mouse by an offset in steps and release it
+        yield [pygame.event.Event(MOUSEBUTTONDOWN, button=1, pos=pos)]
+        x, y = pos
+        for i in range(1, self.steps + 1):
+            nx = pos[0] + delta[0] * i // self.steps
+            ny = pos[1] + delta[1] * i // self.steps
+            yield [pygame.event.Event(MOUSEMOTION, pos=(nx, ny), rel=(nx - x, ny - y), buttons=(1, 0, 0))]
+            x, y = nx, ny
+        yield [pygame.event.Event(MOUSEBUTTONUP, button=1, pos=(x, y))]
+
+class Simulator(object):
+    def __init__(self, motive, seed=None, edge_code=None, geometry=None, group=3, steps=4):
+        # Initialize a game played by the solver, the display may use any video driver including SDL's dummy one
+        self.motive = motive  # File name of the motive to solve
+        self.seed = seed  # Fixed puzzle seed, or None for a new layout
+        self.edge_code = edge_code  # Shared edge table, or None to generate the edges from the seed
+        self.geometry = geometry  # Grid size of the puzzle, or None for the default 10x8
+        self.group = group  # Number of pieces the solver joins before dropping them on the board
+        self.steps = steps  # Mouse motion events of one drag
+        self.screen = pygame.display.set_mode(WINDOW_SIZE)
+
+    def run(self, max_frames=None):
+        # Cut the puzzle, solve it as fast as possible and return the measured throughput
+        start = perf_counter()
+        part = LoadPart(self.motive, "Solver", self.seed, self.edge_code, self.geometry)
+        while part.update(self.screen) != 1:
+            pass
+        load_seconds = perf_counter() - start
+
+        game = GamePart(part.pieces, part.image, "Solver", part.seed, part.geometry, part.filename)
+        solver = Solver(game, self.group, self.steps)
+        pygame.event.clear()
+
+        frames = 0  # Frames drawn
+        events = 0  # Events handled by the game
+        longest = 0.0  # Slowest frame in seconds
+        start = perf_counter()
+        game.update(self.screen)
+        pygame.display.flip()
+        while max_frames is None or frames < max_frames:
+            script = solver.next_events()
+            if script is None:
+                break
+            frame_start = perf_counter()
+
+            # The events go through the queue like real input
+            for event in script:
+                pygame.event.post(event)
+            for event in pygame.event.get():
+                game.event(event)
+                events += 1
+
+            game.update(self.screen)
+            pygame.display.update(game.dirty_rects)
+            frames += 1
+            longest = max(longest, perf_counter() - frame_start)
+        seconds = perf_counter() - start
+
+        game.score_table.close()  # The solver's score is not saved
+        return {
+            "motive": self.motive,
+            "seed": part.seed,
+            "pieces": part.geometry.count,
+            "completed": game.game_completed,
+            "load_seconds": load_seconds,
+            "seconds": seconds,
+            "frames": frames,
+            "events": events,
+            "fps": frames / seconds if seconds else 0.0,
+            "events_per_second": events / seconds if seconds else 0.0,
+            "frame_ms_max": longest * 1000.0,
+        }
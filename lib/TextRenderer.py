@@ -0,0 +1,37 @@
+from collections import OrderedDict
+
+from lib.Loader import Loader
+
+class TextRenderer(object):
+    def __init__(self, loader=None, max_surfaces=128):
+        # Initialize the font and rendered text caches
+        self.loader = loader or Loader()  # Resource loader for the font files
+        self.max_surfaces = max_surfaces  # Number of rendered texts kept before the oldest is dropped
+        self.fonts = {}  # Fonts keyed by (face, size)
+        self.surfaces = OrderedDict()  # Rendered texts keyed by (text, face, size, color), least recently used first
+
+    def font(self, face, size):
+        # Return the font of a face ("black" or "medium") and size, loading it only once
+        key = (face, size)
+        font = self.fonts.get(key)
+        if font is None:
+            font = getattr(self.loader, "load_font_" + face)(size)
+            self.fonts[key] = font
+        return font
+
+    def size(self, text, face, size):
+        # Return the size a text would be rendered at without rendering it
+        return self.font(face, size).size(text)
+
+    def render(self, text, face, size, color):
+        # Return the antialiased text surface, rendering it only if it is not cached
+        key = (text, face, size, tuple(color))
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = self.font(face, size).render(text, True, color)
+            self.surfaces[key] = surface
+            if len(self.surfaces) > self.max_surfaces:
+                self.surfaces.popitem(last=False)  # Drop the least recently used text
+        else:
+            self.surfaces.move_to_end(key)
+        return surface
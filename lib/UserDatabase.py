@@ -1,7 +1,176 @@
 import sqlite3
 import os
+import logging
+import queue
+import threading
+
+log = logging.getLogger(__name__)
+
+# Schema migrations, the database's PRAGMA user_version tells how many of them were applied
+MIGRATIONS = [
+    # 1: The original tables, scores keyed by the free-text user name
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_name TEXT NOT NULL UNIQUE
+    );
+    CREATE TABLE IF NOT EXISTS scores (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_name TEXT NOT NULL,
+        score INTEGER NOT NULL,
+        time REAL NOT NULL,
+        FOREIGN KEY (user_name) REFERENCES users (user_name) ON DELETE CASCADE
+    );
+    """,
+    # 2: Scores reference users by id, record the motive and piece count, and are indexed for the lookups.
+    #    Users only known from their scores get negative ids so they do not become the most recently added user.
+    """
+    INSERT INTO users (id, user_name)
+        SELECT -ROW_NUMBER() OVER (ORDER BY user_name), user_name
+        FROM (SELECT DISTINCT user_name FROM scores WHERE user_name NOT IN (SELECT user_name FROM users));
+    CREATE TABLE scores_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        score INTEGER NOT NULL,
+        time REAL NOT NULL,
+        motive TEXT,
+        pieces INTEGER,
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+    );
+    INSERT INTO scores_new (id, user_id, score, time)
+        SELECT scores.id, users.id, scores.score, scores.time
+        FROM scores JOIN users ON users.user_name = scores.user_name;
+    DROP TABLE scores;
+    ALTER TABLE scores_new RENAME TO scores;
+    CREATE INDEX scores_rank ON scores (score DESC, time ASC);
+    CREATE INDEX scores_user_best ON scores (user_id, score DESC);
+    """,
+]
+
+class ConnectionManager(object):
+    def __init__(self, db_file, batch_size=64):
+        # Open the database in WAL mode, bring its schema up to date once and prepare the writer queue
+        self.db_file = db_file  # Path of the database file
+        self.batch_size = batch_size  # Most writes committed in one transaction
+        self.local = threading.local()  # Connection of the current thread
+        self.lock = threading.Lock()  # Guards the connection list and the pending users
+        self.connections = []  # Every connection opened, closed together
+        self.queue = queue.Queue()  # Writes waiting for the writer thread
+        self.writer = None  # Thread committing the queued writes, started by the first write
+        self.pending_users = []  # Users queued for adding but not committed yet
+        self._migrate(self.connection())
+
+    def connection(self):
+        # Return the connection of the current thread, opening it on first use
+        conn = getattr(self.local, "connection", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")  # Readers never wait for the writer
+            conn.execute("PRAGMA synchronous = NORMAL")  # WAL stays consistent without a sync on every commit
+            conn.execute("PRAGMA foreign_keys = ON")  # Enforce the user references of scores
+            self.local.connection = conn
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def _migrate(self, conn):
+        # Apply the schema migrations this database has not seen yet, each in its own transaction
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            conn.executescript("BEGIN;\n%s\nPRAGMA user_version = %d;\nCOMMIT;" % (script, number))
+
+    def submit(self, task, done=None):
+        # Queue a write, task(connection) runs on the writer thread and done(result) after its batch is committed
+        if self.writer is None:
+            self.writer = threading.Thread(target=self._write, name="db-writer", daemon=True)
+            self.writer.start()
+        self.queue.put((task, done))
+
+    def _write(self):
+        # Commit the queued writes in batches until the stop marker arrives
+        conn = self.connection()
+        conn.isolation_level = None  # Transactions are managed explicitly
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            running = None not in batch
+            try:
+                self._commit(conn, [item for item in batch if item is not None])
+            except Exception:
+                log.exception("Database write batch failed")
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()  # Keep the unfinished count of the queue right even if the batch failed
+
+    def _commit(self, conn, batch):
+        # Run a batch of writes in one transaction, then call their completion callbacks
+        finished = []
+        conn.execute("BEGIN")
+        for task, done in batch:
+            conn.execute("SAVEPOINT task")  # A failing write only undoes itself
+            try:
+                finished.append((done, task(conn)))
+                conn.execute("RELEASE task")
+            except Exception:
+                log.exception("Database write failed")
+                conn.execute("ROLLBACK TO task")
+                conn.execute("RELEASE task")
+        conn.execute("COMMIT")
+
+        for done, result in finished:
+            if done is not None:
+                try:
+                    done(result)
+                except Exception:
+                    log.exception("Database write callback failed")
+
+    def close(self):
+        # Commit the queued writes, stop the writer thread and close every connection
+        if self.writer is not None:
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+        self.local = threading.local()
+
+# Connection manager shared by every UserDatabase in the process
+_manager = None
+
+def get_manager(db_file):
+    # Return the shared connection manager, opening the database on first use
+    global _manager
+    if _manager is None:
+        _manager = ConnectionManager(db_file)
+    return _manager
+
+def close_database():
+    # Commit the queued writes and close the shared database, it is opened again when needed
+    global _manager
+    if _manager is not None:
+        _manager.close()
+        _manager = None
+
+def _best_score(conn, user_name):
+    # Return the best score of a user on a connection, or None if the user has no scores
+    return conn.execute("""
+        SELECT MAX(scores.score)
+        FROM scores JOIN users ON users.id = scores.user_id
+        WHERE users.user_name = ?
+    """, (user_name,)).fetchone()[0]
 
 class UserDatabase:
+    scores_version = 0  # Counter bumped on every score written in this process, lets readers skip unchanged queries
+
     def __init__(self, db_name="users.db"):
         # Initialize the database connection and create necessary tables
         db_path = os.path.join("data", "db")  # Path to the database directory
@@ -9,33 +178,15 @@ class UserDatabase:
 
         self.db_file = os.path.join(db_path, db_name)  # Full path to the database file
 
-        self.connection = sqlite3.connect(self.db_file)  # Connect to the SQLite database
+        self.manager = get_manager(self.db_file)  # Shared connections, schema and writer thread
+        self.connection = self.manager.connection()  # Connection of the current thread
         self.cursor = self.connection.cursor()  # Create a cursor for executing SQL commands
-        self._create_table()  # Create tables if they don't exist
-
-    def _create_table(self):
-        # Create the "users" table to store user information
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_name TEXT NOT NULL UNIQUE
-            )
-        """)
-
-        # Create the "scores" table to store user scores
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS scores (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_name TEXT NOT NULL,
-                score INTEGER NOT NULL,
-                time REAL NOT NULL,
-                FOREIGN KEY (user_name) REFERENCES users (user_name) ON DELETE CASCADE
-            )
-        """)
-        self.connection.commit()  # Commit the changes to the database
 
     def get_last_user(self):
         # Retrieve the most recently added user
+        with self.manager.lock:
+            if self.manager.pending_users:
+                return self.manager.pending_users[-1]
         self.cursor.execute("""
             SELECT user_name FROM users
             ORDER BY id DESC
@@ -46,18 +197,69 @@ class UserDatabase:
 
     def user_exists(self, user_name):
         # Check if a user with the given username exists in the database
+        with self.manager.lock:
+            if user_name in self.manager.pending_users:
+                return True
         self.cursor.execute("""
             SELECT 1 FROM users WHERE user_name = ?
         """, (user_name,))
         return self.cursor.fetchone() is not None  # Return True if the user exists, otherwise False
 
     def add_user(self, user_name):
-        # Add a new user to the database
+        # Queue adding a new user, it counts as existing right away
+        with self.manager.lock:
+            self.manager.pending_users.append(user_name)
+
+        def task(conn):
+            conn.execute("""
+                INSERT OR IGNORE INTO users (user_name) VALUES (?)
+            """, (user_name,))
+
+        def done(result):
+            with self.manager.lock:
+                self.manager.pending_users.remove(user_name)
+
+        self.manager.submit(task, done)
+
+    def get_top_scores(self, limit=10):
+        # Retrieve the best scores as (user_name, score, time), ordered by score (descending) and time (ascending)
         self.cursor.execute("""
-            INSERT INTO users (user_name) VALUES (?)
-        """, (user_name,))
-        self.connection.commit()  # Commit the changes to the database
+            SELECT users.user_name, scores.score, scores.time
+            FROM scores JOIN users ON users.id = scores.user_id
+            ORDER BY scores.score DESC, scores.time ASC
+            LIMIT ?
+        """, (limit,))
+        return self.cursor.fetchall()
+
+    def get_best_score(self, user_name):
+        # Retrieve the best score of a user, or None if the user has no scores
+        return _best_score(self.connection, user_name)
+
+    def add_best_score(self, user_name, score, time, motive=None, pieces=None):
+        # Queue recording a finished game if it beats the user's best score, adding the user if it is not known yet
+        def task(conn):
+            conn.execute("""
+                INSERT OR IGNORE INTO users (user_name) VALUES (?)
+            """, (user_name,))
+            best_score = _best_score(conn, user_name)
+            if best_score is not None and score <= best_score:
+                return False
+            conn.execute("""
+                INSERT INTO scores (user_id, score, time, motive, pieces)
+                SELECT id, ?, ?, ?, ? FROM users WHERE user_name = ?
+            """, (score, time, motive, pieces, user_name))
+            return True
+
+        def done(inserted):
+            if inserted:
+                self.scores_changed()
+
+        self.manager.submit(task, done)
+
+    def scores_changed(self):
+        # Announce a new score row to every reader of the scores table
+        UserDatabase.scores_version += 1
 
     def close(self):
-        # Close the database connection
-        self.connection.close()
\ No newline at end of file
+        # Release the cursor, the shared connections stay open until close_database is called
+        self.cursor.close()
@@ -1,3 +1,5 @@
+import argparse
+import os
 import pygame
 from pygame.locals import *
 
@@ -5,10 +7,18 @@ from lib.GamePart import GamePart
 from lib.MenuPart import MenuPart
 from lib.LoadPart import LoadPart
 from lib.Config import WINDOW_SIZE
+from lib.Geometry import fit_geometry
+from lib.Puzzle import decode_edges
+from lib.UserDatabase import close_database
+from lib.Simulator import Simulator
+from lib.Loader import Loader
 
 class PygamePuzzle(object):
-    def __init__(self):
+    def __init__(self, seed=None, edge_code=None, geometry=None):
         # Initialize the game window
+        self.geometry = geometry  # Grid size of the puzzles, or None for the default 10x8
+        self.seed = seed  # Fixed puzzle seed, or None for a new layout every game
+        self.edge_code = edge_code  # Shared edge table, or None to generate the edges from the seed
         self.screen = pygame.display.set_mode((WINDOW_SIZE), 1)
         pygame.display.set_caption("Pygame Puzzle")  # Set the window title
 
@@ -16,7 +26,7 @@ class PygamePuzzle(object):
         # Main game loop
         clock = pygame.time.Clock()  # Clock to control the frame rate
 
-        cur_part = MenuPart()  # Start with the menu screen
+        cur_part = MenuPart(self.geometry)  # Start with the menu screen
 
         while 1:
             clock.tick(30)  # Limit the frame rate to 30 FPS
@@ -24,34 +34,98 @@ class PygamePuzzle(object):
             # Handle events
             for event in pygame.event.get():
                 if event.type == QUIT:  # Exit the game if the window is closed
+                    if isinstance(cur_part, GamePart):
+                        cur_part.close()
                     return
                 cur_part.event(event)  # Pass the event to the current part of the game
 
             # Update the current part and get the next state
             next = cur_part.update(self.screen)
+            rects = getattr(cur_part, "dirty_rects", None)  # Parts that track changes redraw only parts of the screen
 
             if next == 1:  # Transition to the next part
                 if isinstance(cur_part, MenuPart):
                     # Transition from the menu to the loading screen
                     user_name = cur_part.user_name
-                    cur_part = LoadPart(cur_part.get_motive(), user_name)
+                    cur_part = LoadPart(cur_part.get_motive(), user_name, self.seed, self.edge_code, self.geometry,
+                                        cur_part.take_prefetched())
                 elif isinstance(cur_part, LoadPart):
                     # Transition from the loading screen to the game
-                    cur_part = GamePart(cur_part.pieces, cur_part.image, cur_part.user_name)
+                    print("Puzzle seed: %d, edges: %s" % (cur_part.seed, cur_part.edge_code))
+                    cur_part = GamePart(cur_part.pieces, cur_part.image, cur_part.user_name, cur_part.seed, cur_part.geometry,
+                                        cur_part.filename)
             elif next == -1:  # Exit or return to the menu
                 if isinstance(cur_part, MenuPart):
                     return  # Exit the game
                 else:
-                    cur_part = MenuPart()  # Return to the menu
+                    if isinstance(cur_part, GamePart):
+                        cur_part.close()  # Save the score of the finished game
+                    cur_part = MenuPart(self.geometry)  # Return to the menu
 
-            pygame.display.flip()  # Update the display
+            # Update the display
+            if rects is None:
+                pygame.display.flip()
+            elif rects:
+                pygame.display.update(rects)
+
+def edge_table(code):
+    # Check an edge table given on the command line
+    try:
+        decode_edges(code)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return code
+
+def grid_size(value):
+    # Check a number of pieces in a row or column given on the command line
+    try:
+        count = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a whole number, got %r" % value)
+    if count < 1:
+        raise argparse.ArgumentTypeError("a puzzle needs at least one piece in each row and column, got %d" % count)
+    return count
 
 def main():
+    # Parse the optional puzzle layout arguments
+    parser = argparse.ArgumentParser(description="Pygame Puzzle")
+    parser.add_argument("--seed", type=int, help="seed of the puzzle edges and piece order")
+    parser.add_argument("--edges", type=edge_table, help="shared edge table printed by a previous game")
+    parser.add_argument("--cols", type=grid_size, default=10, help="number of pieces in a row")
+    parser.add_argument("--rows", type=grid_size, default=8, help="number of pieces in a column")
+    parser.add_argument("--headless", action="store_true", help="let a scripted solver play without a window and report its speed")
+    parser.add_argument("--motive", help="motive solved in headless mode, the first one by default")
+    parser.add_argument("--group", type=int, default=3, help="pieces the headless solver joins before dropping them on the board")
+    args = parser.parse_args()
+    if args.edges:
+        edges = decode_edges(args.edges)
+        args.cols, args.rows = len(edges[0]), len(edges)  # The edge table fixes the grid
+    try:
+        geometry = fit_geometry(args.cols, args.rows)
+    except ValueError as e:
+        parser.error(str(e))
+
     # Initialize pygame and start the game
+    if args.headless:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"  # No window or GPU is needed
     pygame.init()
 
-    g = PygamePuzzle()  # Create the game instance
+    if args.headless:
+        sim = Simulator(args.motive or sorted(Loader().list_motives())[0], args.seed, args.edges,
+                        geometry, args.group)
+        result = sim.run()
+        close_database()
+        print("Solved %s (%d pieces, seed %d): %s" % (result["motive"], result["pieces"], result["seed"],
+                                                      "completed" if result["completed"] else "not completed"))
+        print("Cutting: %.2f s" % result["load_seconds"])
+        print("Playing: %.2f s, %d frames (%.1f fps), %d events (%.1f events/s), slowest frame %.1f ms" % (
+            result["seconds"], result["frames"], result["fps"], result["events"], result["events_per_second"],
+            result["frame_ms_max"]))
+        return
+
+    g = PygamePuzzle(args.seed, args.edges, geometry)  # Create the game instance
     g.main_loop()  # Start the main loop
+    close_database()  # Write the queued scores before exiting
 
 if __name__ == '__main__':
     main()  # Run the game if this file is executed directly
\ No newline at end of file